@@ -0,0 +1,140 @@
+from collections import OrderedDict
+from datetime import timedelta
+
+from SecurityBot import clock
+from SecurityBot.queues import PRIORITY_ALARM, PRIORITY_NOTICE
+
+
+class AlarmAggregator(object):
+    """
+    Sits between alarm state changes and the outbound queue
+    State changes that land within `window` of each other are merged, a lone change is posted as a single line
+    while several are posted as one digest that is updated in place until every location in it has settled
+
+    Slack doesn't notify anyone about an edit, so a new alarm (or any change once the digest is older than `max_age`)
+    starts a new digest rather than updating one that may have long scrolled away
+    """
+    RAISED = "raised"
+    ONGOING = "ongoing"
+    FINISHED = "finished"
+    EXPIRED = "expired"
+
+    # The order (and wording) of each state in a digest
+    digest_states = (
+        (RAISED, ":rotating_light: {0} under attack: {1}"),
+        (ONGOING, "{0} still under attack: {1}"),
+        (FINISHED, "{0} no longer under attack: {1}"),
+        (EXPIRED, "{0} expired: {1}"),
+    )
+
+    single_messages = {
+        RAISED: "Uhh ohh, {0} is under attack!",
+        ONGOING: "btw, {0} is still under attack!",
+        FINISHED: "{0} is no longer under attack!",
+        EXPIRED: "{0}'s alarm has expired",
+    }
+
+    settled_states = (FINISHED, EXPIRED)
+
+    def __init__(self, window, write_queue, name="alarm-digest", max_age=timedelta(minutes=10)):
+        self.window = window
+        self.max_age = max_age
+        self.write_queue = write_queue
+        self.name = name
+
+        self.pending = OrderedDict()
+        self.pending_since = None
+
+        self.digest = None
+        self.digest_key = None
+        self.digest_started = None
+        self.digest_count = 0
+
+    def add(self, location, state):
+        """ Records a state change for a location, later changes replace earlier ones within the window """
+        if self.pending_since is None:
+            self.pending_since = clock.utcnow()
+
+        self.pending.pop(location, None)
+        self.pending[location] = state
+
+    def flush(self, force=False):
+        """
+        Posts any pending state changes once the window has passed since the first of them
+        :param force: Post regardless of the window
+        :return:
+        """
+        if not self.pending:
+            return
+
+        if not force and clock.utcnow() - self.pending_since < self.window:
+            return
+
+        pending, self.pending, self.pending_since = self.pending, OrderedDict(), None
+
+        if self.digest is None and len(pending) == 1:
+            location, state = pending.popitem()
+            text = self.single_messages[state].format(location.title())
+
+            if state == self.ONGOING:
+                # Repeat notices for the same location replace each other while they're queued
+                self.post(text, PRIORITY_NOTICE, coalesce_key="{0}-{1}-{2}".format(self.name, state, location))
+            else:
+                # State changes are never shed, and stay in order with the alarms around them
+                self.post(text, PRIORITY_ALARM)
+
+            return
+
+        if self.digest is None:
+            self.start_digest(OrderedDict())
+        elif self.RAISED in pending.values() or clock.utcnow() - self.digest_started > self.max_age:
+            # The new digest carries on with the locations that haven't settled yet
+            self.start_digest(OrderedDict(
+                (location, state) for location, state in self.digest.items() if state not in self.settled_states
+            ))
+
+        for location, state in pending.items():
+            self.digest.pop(location, None)
+            self.digest[location] = state
+
+        self.post(self.render_digest(), PRIORITY_ALARM, coalesce_key=self.digest_key, update_key=self.digest_key)
+
+        # Once everything in the digest has settled the next storm starts a fresh digest
+        if all(state in self.settled_states for state in self.digest.values()):
+            self.digest = None
+            self.digest_key = None
+
+    def start_digest(self, digest):
+        self.digest = digest
+        self.digest_count += 1
+        self.digest_key = "{0}-{1}".format(self.name, self.digest_count)
+        self.digest_started = clock.utcnow()
+
+    def render_digest(self):
+        lines = []
+
+        for state, template in self.digest_states:
+            locations = [location.title() for location, s in self.digest.items() if s == state]
+
+            if not locations:
+                continue
+
+            count = "1 location" if len(locations) == 1 else "{0} locations".format(len(locations))
+            lines.append(template.format(count, ", ".join(locations)))
+
+        return "\n".join(lines)
+
+    def post(self, text, priority, coalesce_key=None, update_key=None):
+        options = {
+            "channel": None
+        }
+
+        if update_key:
+            options["update_key"] = update_key
+
+        self.write_queue.put({
+            "text": text,
+            "priority": priority,
+            "coalesce_key": coalesce_key,
+            "options": options,
+        })
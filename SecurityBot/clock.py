@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+
+import time
+
+
+class Clock(object):
+    """ The wall clock, everything that keeps time based state (alarms, throttles, etc) reads the time from here """
+    def monotonic(self):
+        return time.monotonic()
+
+    def utcnow(self):
+        return datetime.utcnow()
+
+    def now(self):
+        return datetime.now()
+
+
+class SimulatedClock(Clock):
+    """ A clock that runs `rate` times faster than the wall clock, from the moment it's created """
+    def __init__(self, rate):
+        self.rate = rate
+        self.started = time.monotonic()
+        self.started_utc = datetime.utcnow()
+        self.started_local = datetime.now()
+
+    def elapsed(self):
+        return (time.monotonic() - self.started) * self.rate
+
+    def monotonic(self):
+        return self.started + self.elapsed()
+
+    def utcnow(self):
+        return self.started_utc + timedelta(seconds=self.elapsed())
+
+    def now(self):
+        return self.started_local + timedelta(seconds=self.elapsed())
+
+
+
+class VirtualClock(SimulatedClock):
+    """ A clock that stands still until it's advanced, so whatever drives it decides how fast time passes """
+    def __init__(self):
+        super(VirtualClock, self).__init__(0)
+        self.advanced = 0
+
+    def elapsed(self):
+        return self.advanced
+
+    def advance(self, seconds):
+        self.advanced += seconds
+
+
+current = Clock()
+
+
+def set_clock(clock):
+    global current
+    current = clock
+
+
+def monotonic():
+    return current.monotonic()
+
+
+def utcnow():
+    return current.utcnow()
+
+
+def now():
+    return current.now()
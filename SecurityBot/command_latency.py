@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+from queue import Empty
+
+import time
+import random
+import logging
+import argparse
+import threading
+
+from SecurityBot.queues import MessageQueue
+from SecurityBot.soak import StandInZoneMinder
+from SecurityBot.security_interfaces.zoneminder import ZoneMinderInterface
+
+
+class SlowZoneMinder(StandInZoneMinder):
+    """ The soak's ZoneMinder stand-in, taking get_latency/post_latency seconds to answer like a loaded ZoneMinder """
+    def __init__(self, monitor_ids, get_latency, post_latency, rng):
+        # Alarms are rare, we're only interested in how long things take
+        super(SlowZoneMinder, self).__init__(monitor_ids, 7 * 24 * 60 * 60, rng)
+
+        self.get_latency = get_latency
+        self.post_latency = post_latency
+
+    def get(self, url, params=None, **kwargs):
+        time.sleep(self.get_latency)
+        return super(SlowZoneMinder, self).get(url, params, **kwargs)
+
+    def post(self, url, **kwargs):
+        time.sleep(self.post_latency)
+        return super(SlowZoneMinder, self).post(url, **kwargs)
+
+
+class SweepLog(object):
+    """ Records the (start, end) of every sweep by watching the interface's loop timer """
+    def __init__(self, loop_timer):
+        self.loop_timer = loop_timer
+        self.sweeps = []
+
+    def run(self, stop_event):
+        iterations = self.loop_timer.iterations
+
+        while not stop_event.wait(0.001):
+            if self.loop_timer.iterations != iterations:
+                iterations = self.loop_timer.iterations
+                ended = self.loop_timer.last_beat
+                self.sweeps.append((ended - self.loop_timer.last_duration, ended))
+
+    def wait_for(self, count):
+        while len(self.sweeps) < count:
+            time.sleep(0.001)
+
+    def wait_until_after(self, moment):
+        while not self.sweeps or self.sweeps[-1][1] <= moment:
+            time.sleep(0.001)
+
+    def overlapping(self, started, ended):
+        return [(start, end) for start, end in self.sweeps if start <= ended and end >= started]
+
+
+def collect_replies(write_queue, replies, stop_event):
+    """ Notes when (and with what) each benchmark command's reply comes back, keyed by the channel it was sent from """
+    while not stop_event.is_set():
+        try:
+            message = write_queue.get(timeout=0.01)
+        except Empty:
+            continue
+
+        channel = message["options"].get("channel")
+
+        if channel is not None and channel not in replies:
+            replies[channel] = (time.monotonic(), message["text"])
+
+
+def build_interface(monitors, users, get_latency, post_latency, rng, logger):
+    locations = ["location-{0}".format(i) for i in range(monitors)]
+
+    config = {
+        "url": "http://stand-in/zm",
+        "event_socket": None,
+        "history_database": ":memory:",
+        "history_sync_interval": "1d",
+    }
+
+    for setting in ("alarm_alert_interval", "alarm_expires_at", "alarm_retention", "alarm_digest_window",
+                    "history_window", "history_retention"):
+        config[setting] = "1d"
+
+    zoneminder = ZoneMinderInterface(config,
+                                     ["zoneminder:user-{0}:*:{1}".format(i, ",".join(locations)) for i in range(users)],
+                                     ["zoneminder:{0}:{1}".format(location, i) for i, location in enumerate(locations)],
+                                     (MessageQueue(), MessageQueue()),
+                                     logger)
+
+    monitor_ids = list(zoneminder.monitors.keys())
+    zoneminder.session = SlowZoneMinder(monitor_ids, get_latency, post_latency, rng)
+    zoneminder.command_sessions = [SlowZoneMinder(monitor_ids, get_latency, post_latency, rng)
+                                   for _ in range(zoneminder.command_workers)]
+    zoneminder.history_session = SlowZoneMinder(monitor_ids, get_latency, post_latency, rng)
+    zoneminder.poll_interval = 0.01
+
+    return zoneminder, locations
+
+
+def send_commands(zoneminder, commands, locations, users):
+    """ Sends one arm command per location (so none are collapsed together), round robin across the users """
+    sent = {}
+
+    for i in range(commands):
+        channel = "bench-{0}".format(i)
+        sent[channel] = time.monotonic()
+
+        zoneminder.read_queue.put({
+            "command": "arm",
+            "options": [locations[i % len(locations)]],
+            "common_id": "user-{0}".format(i % users),
+            "response_options": {
+                "channel": channel,
+            },
+        })
+
+    return sent
+
+
+def benchmark(monitors, commands, users, get_latency, post_latency, baseline_sweeps, logger):
+    """
+    Sends a burst of commands just as a sweep starts, after timing baseline_sweeps sweeps without any
+    Bursts bigger than the command throttle allows have the rest of their commands turned away
+    :return: The baseline sweeps, the sweeps that ran while commands were in flight, the latency of each command that
+             was run and the number that were throttled
+    """
+    zoneminder, locations = build_interface(monitors, users, get_latency, post_latency, random.Random(0), logger)
+
+    stop_event = threading.Event()
+    sweep_log = SweepLog(zoneminder.loop_timer)
+    replies = {}
+
+    threads = [
+        threading.Thread(target=zoneminder.monitor, args=(stop_event,), name=zoneminder.name),
+        threading.Thread(target=sweep_log.run, args=(stop_event,), name="sweep-log"),
+        threading.Thread(target=collect_replies, args=(zoneminder.write_queue, replies, stop_event), name="replies"),
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    try:
+        sweep_log.wait_for(baseline_sweeps)
+        baseline = list(sweep_log.sweeps)
+
+        # Send the burst right at the start of a sweep, the worst case for a sweep that yields to commands
+        sweep_log.wait_for(baseline_sweeps + 1)
+        sent = send_commands(zoneminder, commands, locations, users)
+
+        while len(replies) < len(sent):
+            time.sleep(0.001)
+
+        # Let the sweep that overlapped the last reply finish
+        first_sent, last_reply = min(sent.values()), max(replied for replied, _ in replies.values())
+        sweep_log.wait_until_after(last_reply)
+    finally:
+        stop_event.set()
+
+        for thread in threads:
+            thread.join()
+
+    during = sweep_log.overlapping(first_sent, last_reply)
+    throttled = [channel for channel, (_, text) in replies.items() if text.startswith("Whoa, slow down")]
+    latencies = sorted(replies[channel][0] - sent[channel] for channel in sent if channel not in throttled)
+
+    return baseline, during, latencies, len(throttled)
+
+
+def describe(sweeps):
+    durations = [end - start for start, end in sweeps]
+
+    if not durations:
+        return "none"
+
+    return "{0} sweep(s), mean {1:.2f}s, max {2:.2f}s".format(len(durations), sum(durations) / len(durations),
+                                                             max(durations))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure command latency, and the sweep's, while commands run during a sweep")
+    parser.add_argument("--monitors", type=int, default=300, help="Number of stand-in ZoneMinder monitors")
+    parser.add_argument("--commands", type=int, default=5, help="Number of arm commands to send at once")
+    parser.add_argument("--users", type=int, default=5, help="Number of users the commands are sent from")
+    parser.add_argument("--get-latency", type=float, default=0.002, help="Seconds ZoneMinder takes to answer a status")
+    parser.add_argument("--post-latency", type=float, default=3, help="Seconds ZoneMinder takes to arm a monitor")
+    parser.add_argument("--baseline-sweeps", type=int, default=3, help="Sweeps to time before sending any commands")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    logger = logging.getLogger("SecurityBot")
+    logging.getLogger("SecurityBot.zoneminder").setLevel(logging.ERROR)
+
+    baseline, during, latencies, throttled = benchmark(args.monitors, args.commands, args.users, args.get_latency,
+                                                       args.post_latency, args.baseline_sweeps, logger)
+
+    logger.info("Sweeps without commands: %s", describe(baseline))
+    logger.info("Sweeps with commands in flight: %s", describe(during))
+    logger.info("Command latency: min %.2fs, median %.2fs, max %.2fs (ZoneMinder takes %.2fs to arm)",
+                latencies[0], latencies[len(latencies) // 2], latencies[-1], args.post_latency)
+    logger.info("%s of %s commands were throttled", throttled, args.commands)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+from queue import Empty
+
+import os
+import time
+import logging
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+from SecurityBot.queues import MessageQueue
+from SecurityBot.security_interfaces.zoneminder import ZoneMinderInterface, send_event
+
+
+def build_interface(event_socket, event_spool, logger):
+    config = {
+        "url": "http://stand-in/zm",
+        "event_socket": event_socket,
+        "event_spool": event_spool,
+        "history_database": ":memory:",
+    }
+
+    for setting in ("alarm_alert_interval", "alarm_expires_at", "alarm_retention", "alarm_digest_window",
+                    "history_sync_interval", "history_window", "history_retention"):
+        config[setting] = "1d"
+
+    # Nothing reads the queue but us, and we keep up, so it never applies backpressure unless we're asked to
+    return ZoneMinderInterface(config, [], ["zoneminder:location-0:0"], (MessageQueue(), MessageQueue()), logger)
+
+
+def count_events(write_queue, counts, stop_event, consume_delay):
+    """ Drains the write queue as a human interface would, counting the events and batches that come through """
+    while not stop_event.is_set():
+        try:
+            message = write_queue.get(timeout=0.01)
+        except Empty:
+            continue
+
+        counts["batches"] += 1
+        counts["events"] += len(message["text"].split("\n"))
+
+        if consume_delay:
+            time.sleep(consume_delay)
+
+
+def send_events(event_socket, event_spool, events, sender):
+    for i in range(events):
+        send_event({"monitor_id": "0", "event_id": "{0}-{1}".format(sender, i)}, event_socket, spool=event_spool)
+
+
+def benchmark(events, senders, consume_delay, logger):
+    """
+    Sends events from the hook's send_event into listen_for_events
+    Each sender is its own process like the hook is, so they don't compete with the listener for the GIL
+    :return: Seconds from the first event being sent until every one was read off the write queue, and the number
+             of batches they came through in
+    """
+    event_directory = tempfile.mkdtemp()
+    event_socket = os.path.join(event_directory, "events.sock")
+    event_spool = os.path.join(event_directory, "spool")
+    zoneminder = build_interface(event_socket, event_spool, logger)
+
+    stop_event = threading.Event()
+    counts = {"events": 0, "batches": 0}
+
+    listener = threading.Thread(target=zoneminder.listen_for_events, args=(event_socket, stop_event), name="events")
+    consumer = threading.Thread(target=count_events, args=(zoneminder.write_queue, counts, stop_event, consume_delay),
+                                name="consumer")
+
+    listener.start()
+    consumer.start()
+
+    while not os.path.exists(event_socket):
+        time.sleep(0.001)
+
+    per_sender = events // senders
+    sender_processes = [multiprocessing.Process(target=send_events, args=(event_socket, event_spool, per_sender, sender))
+                        for sender in range(senders)]
+
+    try:
+        started = time.monotonic()
+
+        for process in sender_processes:
+            process.start()
+
+        for process in sender_processes:
+            process.join()
+
+        while counts["events"] < per_sender * senders:
+            time.sleep(0.001)
+
+        took = time.monotonic() - started
+    finally:
+        stop_event.set()
+        listener.join()
+        consumer.join()
+
+    return took, counts["batches"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure how many hook events per second make it onto the write queue")
+    parser.add_argument("--events", type=int, default=20000, help="Number of events to send")
+    parser.add_argument("--senders", type=int, default=4, help="Number of hooks sending at once")
+    parser.add_argument("--consume-delay", type=float, default=0,
+                        help="Seconds the consumer takes per message, to see the hook blocked by backpressure")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    logger = logging.getLogger("SecurityBot")
+    logging.getLogger("SecurityBot.zoneminder").setLevel(logging.ERROR)
+
+    took, batches = benchmark(args.events, args.senders, args.consume_delay, logger)
+    sent = args.events // args.senders * args.senders
+
+    logger.info("%s events in %.2fs, %.0f events/s, in %s batches (%.1f events per batch)",
+                sent, took, sent / took, batches, sent / batches)
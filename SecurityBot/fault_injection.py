@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+import time
+import random
+import logging
+import argparse
+import threading
+
+from SecurityBot.soak import StandInZoneMinder, build_interfaces
+from SecurityBot.supervisor import Supervisor
+
+
+class FaultyZoneMinder(StandInZoneMinder):
+    """
+    The soak's ZoneMinder stand-in, which fails the next status request on cue, either raising out of the sweep (a
+    crash) or never answering (a hang) until it's released
+    """
+    def __init__(self, monitor_ids, rng):
+        # Alarms are rare, we're only interested in the loop staying up
+        super(FaultyZoneMinder, self).__init__(monitor_ids, 7 * 24 * 60 * 60, rng)
+
+        self.fault = None
+        self.fault_lock = threading.Lock()
+        self.released = threading.Event()
+
+    def inject(self, fault):
+        with self.fault_lock:
+            self.fault = fault
+
+    def get(self, url, params=None, **kwargs):
+        # Only the sweep polls statuses, so that's the loop the fault lands in
+        if self.status_regex.search(url):
+            with self.fault_lock:
+                fault, self.fault = self.fault, None
+
+            if fault == "crash":
+                raise RuntimeError("Injected crash")
+
+            if fault == "hang":
+                self.released.wait()
+
+        return super(FaultyZoneMinder, self).get(url, params, **kwargs)
+
+
+class StandInWorker(object):
+    """ An interface as the supervisor runs it, readying up against its stand-ins instead of connecting out """
+    def __init__(self, interface, ready_up):
+        self.interface = interface
+        self.ready_up = ready_up
+        self.loop_timer = interface.loop_timer
+
+    def is_ready(self):
+        return self.ready_up()
+
+    def monitor(self, stop_event=None):
+        self.interface.monitor(stop_event)
+
+
+def wait_for_recovery(worker, restarts, timeout):
+    """ Waits until the worker has been restarted past `restarts` and is running again, returns False on timeout """
+    give_up_at = time.monotonic() + timeout
+
+    while worker.restarts <= restarts or worker.restart_at is not None:
+        if time.monotonic() > give_up_at:
+            return False
+
+        time.sleep(0.01)
+
+    return True
+
+
+def inject_faults(faults, monitors, hang_timeout, initial_backoff, settle, logger):
+    """
+    Runs the interfaces against stand-ins under a supervisor, injecting each fault into the ZoneMinder sweep in turn
+    and waiting for the supervisor to bring it back before the next
+    :return: The supervisor, and for each fault the seconds from injecting it to the sweep running again (None if it
+             never recovered)
+    """
+    slack, zoneminder = build_interfaces(monitors, 1, random.Random(0), logger)
+
+    stand_in = FaultyZoneMinder(list(zoneminder.monitors.keys()), random.Random(0))
+    zoneminder.poll_interval = 0.05
+
+    def ready_up_zoneminder():
+        zoneminder.session = zoneminder.history_session = stand_in
+        zoneminder.command_sessions = [stand_in] * zoneminder.command_workers
+        return True
+
+    ready_up_zoneminder()
+
+    supervisor = Supervisor(logger, hang_timeout=hang_timeout, initial_backoff=initial_backoff)
+    supervisor.check_interval = 0.05
+
+    supervisor.add(zoneminder.name, StandInWorker(zoneminder, ready_up_zoneminder))
+    supervisor.add(slack.interface_id, StandInWorker(slack, lambda: True))
+    worker = supervisor.workers[0]
+
+    stop_event = threading.Event()
+    supervisor_thread = threading.Thread(target=supervisor.run, args=(stop_event,), name="supervisor")
+    supervisor_thread.start()
+
+    recoveries = []
+
+    try:
+        for fault in faults:
+            time.sleep(settle)
+
+            restarts = worker.restarts
+            injected = time.monotonic()
+            stand_in.inject(fault)
+
+            if wait_for_recovery(worker, restarts, hang_timeout + 10 * initial_backoff + settle):
+                recoveries.append(time.monotonic() - injected)
+            else:
+                recoveries.append(None)
+
+            logger.info("Injected a %s, %s", fault,
+                        "recovered in {0:.2f}s".format(recoveries[-1]) if recoveries[-1] is not None else "never recovered")
+    finally:
+        stop_event.set()
+        supervisor_thread.join()
+
+        # Let the abandoned hung sweep finish
+        stand_in.released.set()
+
+    return supervisor, recoveries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crash then hang the ZoneMinder sweep and time how long the supervisor takes to recover it")
+    parser.add_argument("--faults", nargs="+", choices=("crash", "hang"), default=["crash", "hang"],
+                        help="Faults to inject, in order")
+    parser.add_argument("--monitors", type=int, default=50, help="Number of stand-in ZoneMinder monitors")
+    parser.add_argument("--hang-timeout", type=float, default=2, help="Supervisor hang timeout in seconds")
+    parser.add_argument("--initial-backoff", type=float, default=0.5, help="Supervisor initial restart backoff in seconds")
+    parser.add_argument("--settle", type=float, default=1, help="Seconds to run normally before each fault")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    logger = logging.getLogger("SecurityBot")
+    logging.getLogger("SecurityBot.zoneminder").setLevel(logging.ERROR)
+    logging.getLogger("SecurityBot.slack").setLevel(logging.ERROR)
+
+    supervisor, recoveries = inject_faults(args.faults, args.monitors, args.hang_timeout, args.initial_backoff,
+                                           args.settle, logger)
+
+    logger.info("Mean time to recovery: %s (%s recoveries), from injection: %s",
+                supervisor.mean_time_to_recovery(), len(supervisor.recovery_times),
+                ", ".join("{0} {1}".format(fault, "{0:.2f}s".format(took) if took is not None else "never")
+                          for fault, took in zip(args.faults, recoveries)))
@@ -0,0 +1,72 @@
+from queue import Empty
+from datetime import datetime
+
+import sys
+import threading
+
+from SecurityBot.profiling import LoopTimer
+
+
+class ConsoleInterface(object):
+    """
+    Writes every message from the security interface to a local file, or stdout if no 'path' is configured
+    This is a sink only, it doesn't take commands
+    """
+    name = "console"
+    loop_budget = 2
+
+    def __init__(self, config, users, queues, available_commands, logger):
+        self.config = config
+        self.interface_id = config.get("id", self.name)
+        self.read_queue, self.write_queue = queues
+        self.logger = logger.getChild(self.interface_id)
+        self.output = None
+        self.ready = False
+
+        self.loop_timer = LoopTimer(self.interface_id, config.get("loop_budget", self.loop_budget), self.logger)
+
+    def is_ready(self):
+        path = self.config.get("path")
+
+        # We're called again whenever we're restarted, so don't leave the last file open
+        if self.output is not None and self.output is not sys.stdout:
+            self.output.close()
+
+        self.output = None
+
+        try:
+            self.output = open(path, "at") if path else sys.stdout
+        except OSError:
+            self.logger.exception("Failed to open '%s' for writing", path)
+            return False
+
+        self.ready = True
+
+        return self.ready
+
+    def post_response(self, response):
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        for line in response["text"].splitlines():
+            self.output.write("{0} {1}\n".format(timestamp, line))
+
+        self.output.flush()
+
+    def monitor(self, stop_event=None):
+        if stop_event is None:
+            stop_event = threading.Event()
+
+        if not self.ready:
+            raise RuntimeError("is_ready has not been called/returned false")
+
+        self.logger.info("Console is ready to write messages")
+
+        while not stop_event.is_set():
+            try:
+                response = self.read_queue.get(timeout=1)
+            except Empty:
+                self.loop_timer.beat()
+                continue
+
+            with self.loop_timer:
+                self.post_response(response)
@@ -1,15 +1,59 @@
 from queue import Empty
+from collections import OrderedDict
 from slackclient import SlackClient
 from slackclient.server import SlackConnectionError, SlackLoginError
 
 import re
 import time
 import random
+import threading
+
+from SecurityBot import clock
+from SecurityBot.profiling import LoopTimer
+
+
+class SeenEvents(object):
+    """
+    A bounded, time windowed set of keys, used to drop events we've already read off the firehose
+    Keys are forgotten once they're older than `window` seconds or once we're holding more than `max_size`
+    """
+    def __init__(self, window, max_size):
+        self.window = window
+        self.max_size = max_size
+        self.seen = OrderedDict()
+
+    def __len__(self):
+        return len(self.seen)
+
+    def check(self, key):
+        """ Returns True if we've seen the key within the window, otherwise remembers it and returns False """
+        now = clock.monotonic()
+
+        # Keys are in the order we saw them, so the expired ones are always at the front
+        while self.seen and (len(self.seen) >= self.max_size or now - next(iter(self.seen.values())) > self.window):
+            self.seen.popitem(last=False)
+
+        if key in self.seen:
+            return True
+
+        self.seen[key] = now
+        return False
 
 
 class SlackInterface(object):
     name = "slack"
     web_socket_sleep_delay = 1
+    max_updatable_messages = 100
+
+    # Seconds a single pass over the firehose and our read queue should take before we warn about it
+    loop_budget = 2
+
+    # Set to a Recorder to capture every RTM event we read
+    recorder = None
+
+    # How long (in seconds) and how many events we remember to drop duplicates read off the firehose
+    dedup_window = 600
+    dedup_max_size = 10000
     no_text_messages = (
         "Err... you didn't type anything?",
         "Hi, what's up?",
@@ -18,14 +62,21 @@ class SlackInterface(object):
 
     def __init__(self, config, users, queues, available_commands, logger):
         self.config = config
+        self.interface_id = config.get("id", self.name)
         self.users = dict()
         self.read_queue, self.write_queue = queues
-        self.logger = logger
+        self.logger = logger.getChild(self.interface_id)
         self.slack_client = None
         self.bot_id = config.get("bot_id", None)
         self.channel_id = config.get("channel_id", None)
         self.ready = False
-        self.last_ts = float(0)
+        self.seen_events = SeenEvents(config.get("dedup_window", self.dedup_window),
+                                      config.get("dedup_max_size", self.dedup_max_size))
+
+        # Messages we've posted that the security interface may update in place, keyed by their update_key
+        self.updatable_messages = OrderedDict()
+
+        self.loop_timer = LoopTimer(self.interface_id, config.get("loop_budget", self.loop_budget), self.logger)
 
         for user_mapping in users:
             interface, interface_id, common_id = user_mapping.split(':')
@@ -37,13 +88,13 @@ class SlackInterface(object):
 
         self.available_commands = available_commands
 
-        self.available_commands_help = "Available commands are:\n```"
-        self.available_commands_help += "{0:<20}{1}\n".format("Command", "Help")
-
-        for command, command_dict in self.available_commands.items():
-            self.available_commands_help += "{0:<20}{1}\n".format("'{0}'".format(command), command_dict["help"])
+        # Rendered once here, it's posted with every misunderstood command
+        help_lines = ["{0:<20}{1}".format("Command", "Help")]
+        help_lines.extend("{0:<20}{1}".format("'{0}'".format(command), command_dict["help"])
+                          for command, command_dict in self.available_commands.items())
 
-        self.available_commands_help += "```\n\n"
+        self.commands_help = "Available commands are:\n```{0}\n```\n\n".format("\n".join(help_lines))
+        self.available_commands_help = self.commands_help
 
     def get_user_id(self, user_name):
         """ Attempt to find the user whos name matches, returning the users Slack ID """
@@ -86,20 +137,24 @@ class SlackInterface(object):
             self.bot_id = self.get_user_id(self.config["bot_name"].lower())
 
             if self.bot_id is None:
-                self.logger.error("Failed to obtain the ID of the bot '{0}'".format(self.config["bot_name"]))
+                self.logger.error("Failed to obtain the ID of the bot '%s'", self.config["bot_name"])
                 return False
 
-        self.available_commands_help += "I'm expecting the commands to look like:\n" \
-                                        "<@{0}> command [option]".format(self.bot_id)
+        # is_ready is called again whenever we're restarted, so rebuild rather than append to the help
+        self.available_commands_help = self.commands_help + "I'm expecting the commands to look like:\n" \
+                                                            "<@{0}> command [option]".format(self.bot_id)
 
         # Get our channel's ID
         if not self.channel_id:
             self.channel_id = self.get_channel_id(self.config["channel"].lower())
 
             if self.channel_id is None:
-                self.logger.error("Failed to obtain the ID of the channel '{0}'".format(self.config["channel"]))
+                self.logger.error("Failed to obtain the ID of the channel '%s'", self.config["channel"])
                 return False
 
+        if self.recorder:
+            self.recorder.record(self.interface_id, "ready", {"bot_id": self.bot_id, "channel_id": self.channel_id})
+
         # And we're done here
         self.ready = True
 
@@ -111,6 +166,10 @@ class SlackInterface(object):
         :param event: 
         :return: 
         """
+        # Most of the firehose isn't messages (presence, typing, etc), drop it before anything else
+        if event.get("type") != "message":
+            return False
+
         # We only want text based events
         if "text" not in event:
             return False
@@ -133,27 +192,30 @@ class SlackInterface(object):
         if "ts" not in event:
             return False
 
-        # Maybe we read the same event twice off the firehose?
-        event_timestamp = float(event.get("ts", "0"))
-        if self.last_ts > event_timestamp:
-            return False
-
         # Match on the bot reference being in the message
         bot_mention = "<@{0}>".format(self.bot_id)
 
         # The only direct message we listen to is one to us!
         if event_channel_id.startswith('D'):
-            return True
+            matched = True
 
         # Listen to group chats with a mention to us
-        if event_channel_id.startswith('G') and bot_mention in event["text"]:
-            return True
+        elif event_channel_id.startswith('G') and bot_mention in event["text"]:
+            matched = True
 
         # Listen to our registered channel chat for mentions
-        if event_channel_id.startswith('C') and bot_mention in event["text"]:
-            return True
+        elif event_channel_id.startswith('C') and bot_mention in event["text"]:
+            matched = True
 
-        return False
+        else:
+            matched = False
+
+        # Maybe we read the same event twice off the firehose (eg. after a reconnect)?
+        if matched and self.seen_events.check((event_channel_id, event["ts"])):
+            self.logger.info("Dropping a duplicate event: %s", event)
+            return False
+
+        return matched
 
     def build_request(self, event):
         """
@@ -210,16 +272,81 @@ class SlackInterface(object):
                 "common_id": common_id,
                 "response_options": {
                     "channel": channel,
+                    "interface": self.interface_id,
                 }
             }
 
-    def monitor(self):
+    def post_response(self, response):
+        """
+        Posts a response from the security interface
+        Responses with an update_key replace the text of the message we last posted under that key
+        :param response:
+        :return:
+        """
+        channel = response["options"]["channel"]
+        update_key = response["options"].get("update_key")
+
+        if update_key in self.updatable_messages:
+            channel, ts = self.updatable_messages[update_key]
+            self.slack_client.api_call("chat.update", channel=channel, ts=ts, text=response["text"], as_user=True)
+            return
+
+        api_call = self.slack_client.api_call("chat.postMessage", channel=channel, text=response["text"], as_user=True)
+
+        if update_key and api_call.get("ok", False):
+            self.updatable_messages[update_key] = (api_call["channel"], api_call["ts"])
+
+            while len(self.updatable_messages) > self.max_updatable_messages:
+                self.updatable_messages.popitem(last=False)
+
+    def process_once(self):
+        """
+        A single pass of the event loop
+        Reads whatever is waiting on the firehose and posts at most one response from the security interface
+        :return:
+        """
+        for event in self.slack_client.rtm_read():
+            if not event:
+                continue
+
+            if self.recorder:
+                self.recorder.record(self.interface_id, "rtm", event)
+
+            if self.match_event(event):
+                self.logger.debug("Matched: %s", event, extra={"event_type": event.get("type")})
+                request = self.build_request(event)
+
+                if request:
+                    self.write_queue.put(request)
+            else:
+                # Most of the firehose doesn't match, only log a sample of it
+                self.logger.debug("No Match: %s", event, extra={"event_type": event.get("type"), "rate_limit": "no-match"})
+
+        try:
+            response = self.read_queue.get(block=False)
+            self.logger.debug("Response: %s", response)
+
+            # Default to the registered channel if the response has no channel
+            # This most likely occurs in proactive messages from the security interface
+            if response["options"]["channel"] is None:
+                response["options"]["channel"] = self.channel_id
+
+            self.post_response(response)
+        except Empty:
+            # We don't care if the read queue is empty
+            pass
+
+    def monitor(self, stop_event=None):
         """
         Event loop that will listen to the slack fire-hose for events
         For events with commands, we build a request and send it to the security interface
         We then check for responses from the security interface and post the text response
+        :param stop_event: The loop exits once this is set
         :return: 
         """
+        if stop_event is None:
+            stop_event = threading.Event()
+
         if not self.ready:
             raise RuntimeError("is_ready has not been called/returned false")
 
@@ -228,37 +355,9 @@ class SlackInterface(object):
 
         self.logger.info("Slack is connected and listening for mentions")
 
-        while True:
-            for event in self.slack_client.rtm_read():
-                if not event:
-                    continue
-
-                if self.match_event(event):
-                    self.logger.debug("Matched: {0}".format(event))
-                    request = self.build_request(event)
-
-                    if request:
-                        self.write_queue.put(request)
-                else:
-                    self.logger.debug("No Match: {0}".format(event))
-
-            try:
-                response = self.read_queue.get(block=False)
-                self.logger.debug(response)
-
-                # Default to the registered channel if the response has no channel
-                # This most likely occurs in proactive messages from the security interface
-                if response["options"]["channel"] is None:
-                    response["options"]["channel"] = self.channel_id
-
-                self.slack_client.api_call("chat.postMessage",
-                                           channel=response["options"]["channel"],
-                                           text=response["text"],
-                                           as_user=True)
-            except Empty:
-                # We don't care if the read queue is empty
-                pass
+        while not stop_event.is_set():
+            with self.loop_timer:
+                self.process_once()
 
             # Just so we're not smashing the slack feed
-            time.sleep(1)
-
+            stop_event.wait(self.web_socket_sleep_delay)
@@ -0,0 +1,75 @@
+from queue import Empty
+
+import requests
+import threading
+
+from SecurityBot.profiling import LoopTimer
+
+
+class WebhookInterface(object):
+    """
+    Posts every message from the security interface to a webhook as JSON
+    This is a sink only, it doesn't take commands
+    """
+    name = "webhook"
+    timeout = 10
+    loop_budget = 15
+
+    def __init__(self, config, users, queues, available_commands, logger):
+        self.config = config
+        self.interface_id = config.get("id", self.name)
+        self.read_queue, self.write_queue = queues
+        self.logger = logger.getChild(self.interface_id)
+        self.session = None
+        self.ready = False
+
+        self.timeout = config.get("timeout", self.timeout)
+        self.loop_timer = LoopTimer(self.interface_id, config.get("loop_budget", self.loop_budget), self.logger)
+
+    def is_ready(self):
+        if not self.config.get("url"):
+            self.logger.error("No webhook 'url' has been configured")
+            return False
+
+        # We're called again whenever we're restarted, so don't leave the last session's connections open
+        if self.session is not None:
+            self.session.close()
+
+        self.session = requests.Session()
+        self.ready = True
+
+        return self.ready
+
+    def post_response(self, response):
+        payload = {
+            "text": response["text"],
+            "update_key": response["options"].get("update_key"),
+        }
+
+        try:
+            webhook_response = self.session.post(self.config["url"], json=payload, timeout=self.timeout)
+        except requests.RequestException:
+            self.logger.exception("Failed to post to the webhook")
+            return
+
+        if webhook_response.status_code >= 400:
+            self.logger.error("The webhook returned status %s", webhook_response.status_code)
+
+    def monitor(self, stop_event=None):
+        if stop_event is None:
+            stop_event = threading.Event()
+
+        if not self.ready:
+            raise RuntimeError("is_ready has not been called/returned false")
+
+        self.logger.info("Webhook is ready to post to %s", self.config["url"])
+
+        while not stop_event.is_set():
+            try:
+                response = self.read_queue.get(timeout=1)
+            except Empty:
+                self.loop_timer.beat()
+                continue
+
+            with self.loop_timer:
+                self.post_response(response)
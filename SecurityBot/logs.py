@@ -0,0 +1,90 @@
+from queue import Queue
+from logging.handlers import QueueHandler, QueueListener
+
+import json
+import logging
+import threading
+
+from SecurityBot import clock
+
+# Attributes every LogRecord has, anything else on a record was passed in through 'extra'
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Limits records logged with extra={"rate_limit": <key>} to one per key per interval
+    The next record let through for a key notes how many were suppressed since the last one
+    Records without a rate_limit key are always let through
+    """
+    def __init__(self, interval=10):
+        super(RateLimitFilter, self).__init__()
+        self.interval = interval
+        self.lock = threading.Lock()
+
+        # key -> (last logged at, suppressed since)
+        self.keys = {}
+
+    def filter(self, record):
+        key = getattr(record, "rate_limit", None)
+
+        if key is None:
+            return True
+
+        now = clock.monotonic()
+
+        with self.lock:
+            logged_at, suppressed = self.keys.get(key, (None, 0))
+
+            if logged_at is not None and now - logged_at < self.interval:
+                self.keys[key] = (logged_at, suppressed + 1)
+                return False
+
+            self.keys[key] = (now, 0)
+
+        if suppressed:
+            record.msg = "{0} ({1} similar suppressed)".format(record.msg, suppressed)
+
+        record.suppressed = suppressed
+        return True
+
+
+class StructuredFormatter(logging.Formatter):
+    """ Formats each record as a single JSON object, including anything passed in through 'extra' """
+    def format(self, record):
+        structured = {
+            "time": self.formatTime(record),
+            "logger": record.name,
+            "level": record.levelname,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+
+        for name, value in vars(record).items():
+            if name not in RECORD_ATTRIBUTES:
+                structured[name] = value
+
+        if record.exc_info:
+            structured["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(structured, default=str)
+
+
+def start_logging(logger, handler):
+    """
+    Moves the handler off to a background listener thread, the logger only ever puts records on an unbounded queue
+    so writing logs (eg. to a slow disk) never holds up the interface loops
+    :param logger: The logger to attach to
+    :param handler: The handler that does the actual writing
+    :return: The started QueueListener, stop() it on shutdown to flush any queued records
+    """
+    log_queue = Queue()
+
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter())
+    logger.addHandler(queue_handler)
+
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+
+    return listener
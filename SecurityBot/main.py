@@ -3,16 +3,24 @@
 import os
 import sys
 import yaml
+import atexit
+import signal
 import inspect
 import logging
+import logging.handlers
 import argparse
 import threading
 
-from queue import Queue
 from pydoc import locate
 
 from SecurityBot import human_interfaces
 from SecurityBot import security_interfaces
+from SecurityBot.logs import StructuredFormatter, start_logging
+from SecurityBot.router import MessageRouter
+from SecurityBot.queues import MessageQueue
+from SecurityBot.profiling import SamplingProfiler
+from SecurityBot.supervisor import Supervisor
+from SecurityBot.recording import Recorder
 
 
 def interface_loader(module_directory):
@@ -45,7 +53,7 @@ def interface_loader(module_directory):
     return interfaces
 
 def parse_config(config_file):
-    config = yaml.load(config_file)
+    config = yaml.safe_load(config_file)
 
     # Perform any validation we want to here
 
@@ -57,7 +65,12 @@ if __name__ == "__main__":
 
     parser.add_argument("-v", action="count", default=0, help="Determines logging verbosity")
     parser.add_argument("--log-file", help="Path to log file")
+    parser.add_argument("--log-json", action="store_true", help="Write each log record as a JSON object")
     parser.add_argument("--config", required=True, help="Path to the SecurityBot config file")
+    parser.add_argument("--profile", metavar="PROFILE_DIR",
+                        help="Profile each interface thread into this directory, send SIGUSR2 to dump a live profile")
+    parser.add_argument("--record", metavar="CAPTURE_FILE",
+                        help="Record inbound Slack and ZoneMinder traffic for SecurityBot.replay")
 
     args = parser.parse_args()
 
@@ -76,10 +89,17 @@ if __name__ == "__main__":
     logger.setLevel(log_level)
     handler.setLevel(log_level)
 
-    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    if args.log_json:
+        formatter = StructuredFormatter()
+    else:
+        formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
     handler.setFormatter(formatter)
 
-    logger.addHandler(handler)
+    # The handler runs on its own thread so log I/O never blocks the interfaces, however we exit (including
+    # parser.error, sys.exit and unhandled exceptions) stopping it flushes whatever is still queued
+    log_listener = start_logging(logger, handler)
+    atexit.register(log_listener.stop)
 
     if not os.path.exists(args.config):
         parser.error("Provided config file doesn't exist")
@@ -87,21 +107,33 @@ if __name__ == "__main__":
     with open(args.config, "rt") as config_file:
         config = parse_config(config_file)
 
-    logger.debug("Loaded Config: {0}".format(config))
+    logger.debug("Loaded Config: %s", config)
 
     # Load the interface classes
     security_interfaces = interface_loader(os.path.dirname(security_interfaces.__file__))
-    logger.debug("Loaded Security Interfaces: {0}".format(", ".join(security_interfaces.keys())))
+    logger.debug("Loaded Security Interfaces: %s", ", ".join(security_interfaces.keys()))
 
     human_interfaces = interface_loader(os.path.dirname(human_interfaces.__file__))
-    logger.debug("Loaded Human Interfaces: {0}".format(", ".join(human_interfaces.keys())))
+    logger.debug("Loaded Human Interfaces: %s", ", ".join(human_interfaces.keys()))
+
+    # Bounded priority queues between the interfaces, see MessageQueue for the overflow policy
+    queue_config = config.get("queues", {})
+    queue_options = {
+        "maxsize": queue_config.get("max_size", 100),
+        "reply_ttl": queue_config.get("reply_ttl", 60),
+    }
 
     # Choose the one specific to the config
     SecurityInterfaceClass = security_interfaces.get(config["security_interface"]["name"])
-    security_interface_queue = Queue()
+    security_interface_queue = MessageQueue(**queue_options)
 
-    HumanInterfaceClass = human_interfaces.get(config["human_interface"]["name"])
-    human_interface_queue = Queue()
+    # Any number of human interfaces can be configured, they all share the one queue of commands
+    human_interface_configs = config["human_interface"]
+
+    if isinstance(human_interface_configs, dict):
+        human_interface_configs = [human_interface_configs]
+
+    human_interface_queue = MessageQueue(**queue_options)
 
     # Initialize the classes
     assert isinstance(SecurityInterfaceClass, type)
@@ -111,29 +143,93 @@ if __name__ == "__main__":
                                                 (human_interface_queue, security_interface_queue),
                                                 logger)
 
-    assert isinstance(HumanInterfaceClass, type)
-    human_interface = HumanInterfaceClass(config["human_interface"],
-                                          config["users"],
-                                          (security_interface_queue, human_interface_queue),
-                                          security_interface.get_commands(),
-                                          logger)
+    # Everything the security interface writes is fanned out to the human interfaces
+    router = MessageRouter(security_interface_queue, logger)
 
-    # Ensure the two interfaces are ready (connect to their backend/etc)
-    if not human_interface.is_ready():
-        logger.error("{0} interface failed to ready up".format(human_interface.name.title()))
-        sys.exit(1)
+    # The router keeps the security interface's write queue drained, so hold the hook back on the subscribers instead
+    security_interface.backpressure = router
+    human_interfaces_by_id = {}
+
+    for human_interface_config in human_interface_configs:
+        HumanInterfaceClass = human_interfaces.get(human_interface_config["name"])
+        human_interface_read_queue = MessageQueue(**queue_options)
+
+        assert isinstance(HumanInterfaceClass, type)
+        human_interface = HumanInterfaceClass(human_interface_config,
+                                              config["users"],
+                                              (human_interface_read_queue, human_interface_queue),
+                                              security_interface.get_commands(),
+                                              logger)
+
+        interface_id = human_interface_config.get("id", human_interface.name)
+
+        if interface_id in human_interfaces_by_id:
+            parser.error("Human interface '{0}' is configured twice, give each one a unique 'id'".format(interface_id))
+
+        human_interfaces_by_id[interface_id] = human_interface
+        router.subscribe(interface_id, human_interface_read_queue)
+
+    # Capture inbound traffic before we connect so the capture includes readying up
+    recorder = None
+
+    if args.record:
+        recorder = Recorder(args.record)
+        security_interface.recorder = recorder
+
+        for human_interface in human_interfaces_by_id.values():
+            human_interface.recorder = recorder
+
+    # Ensure the interfaces are ready (connect to their backend/etc)
+    for interface_id, human_interface in human_interfaces_by_id.items():
+        if not human_interface.is_ready():
+            logger.error("%s interface failed to ready up", interface_id.title())
+            sys.exit(1)
 
     if not security_interface.is_ready():
-        logger.error("{0} interface failed to ready up".format(security_interface.name.title()))
+        logger.error("%s interface failed to ready up", security_interface.name.title())
         sys.exit(1)
 
-    # Start the threads
-    human_interface_thread = threading.Thread(target=human_interface.monitor)
-    human_interface_thread.start()
+    # Sample every thread while we're running, dumping a profile whenever we're sent SIGUSR2
+    profiler = None
+
+    if args.profile:
+        profiler = SamplingProfiler(args.profile, logger)
+        profiler.start()
+
+        signal.signal(signal.SIGUSR2, lambda *_: profiler.dump())
+        logger.info("Profiling into %s, send SIGUSR2 to PID %s to dump a profile", args.profile, os.getpid())
+
+    supervisor_config = config.get("supervisor", {})
+    supervisor = Supervisor(logger,
+                            hang_timeout=supervisor_config.get("hang_timeout"),
+                            initial_backoff=supervisor_config.get("initial_backoff"),
+                            max_backoff=supervisor_config.get("max_backoff"))
+
+    # The supervisor runs (and restarts) the router alongside the interfaces
+    supervisor.add(router.name, router)
+    supervisor.add(security_interface.name, security_interface)
+
+    for interface_id, human_interface in human_interfaces_by_id.items():
+        supervisor.add(interface_id, human_interface)
+
+    # Supervise until we're told to stop
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+
+    try:
+        supervisor.run(stop_event)
+    except KeyboardInterrupt:
+        pass
+
+    if profiler:
+        profiler.stop()
+
+    logger.info("Mean time to recovery: %s (%s recoveries)", supervisor.mean_time_to_recovery(), len(supervisor.recovery_times))
+    logger.info("Human interface queue: %s", human_interface_queue.stats())
+    logger.info("Security interface queue: %s", security_interface_queue.stats())
 
-    security_interface_thread = threading.Thread(target=security_interface.monitor)
-    security_interface_thread.start()
+    for interface_id, queue in router.subscribers.items():
+        logger.info("%s queue: %s", interface_id.title(), queue.stats())
 
-    # Wait for the security and human threads to kill themselves off
-    human_interface_thread.join()
-    security_interface_thread.join()
+    if recorder:
+        recorder.close()
@@ -0,0 +1,116 @@
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import os
+import sys
+import threading
+
+from SecurityBot import clock
+
+
+class LoopTimer(object):
+    """
+    Times each iteration of an interface loop, warning when an iteration runs over its budget
+    Use it as a context manager around the body of the loop
+
+    It also doubles as the loop's heartbeat, the supervisor treats a loop that hasn't beat recently as hung
+    Loops that can legitimately spend a while in one iteration should beat() as they make progress
+    """
+    def __init__(self, name, budget, logger):
+        self.name = name
+        self.budget = budget
+        self.logger = logger
+
+        self.started = None
+        self.last_duration = None
+        self.last_beat = clock.monotonic()
+        self.iterations = 0
+        self.over_budget = 0
+
+    def beat(self):
+        self.last_beat = clock.monotonic()
+
+    def __enter__(self):
+        self.started = self.last_beat = clock.monotonic()
+        return self
+
+    def __exit__(self, *_):
+        self.last_beat = clock.monotonic()
+        self.last_duration = self.last_beat - self.started
+        self.iterations += 1
+
+        if self.last_duration > self.budget:
+            self.over_budget += 1
+            self.logger.warning("%s loop took %.2fs, over its %ss budget (%s of %s loops over budget)",
+                                self.name, self.last_duration, self.budget, self.over_budget, self.iterations)
+
+        return False
+
+
+class SamplingProfiler(object):
+    """
+    Periodically samples the stack of every thread, aggregating the samples per thread name
+    Profiles are written out in the folded stack format (one 'frame;frame;frame count' per line) that flame graph
+    tools understand, dump() can be called at any time (eg. from a signal handler) without stopping the sampling
+    """
+    def __init__(self, output_dir, logger, interval=0.01):
+        self.output_dir = output_dir
+        self.logger = logger
+        self.interval = interval
+
+        self.samples = defaultdict(Counter)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.dump()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        frames = sys._current_frames()
+
+        with self.lock:
+            for thread in threading.enumerate():
+                if thread is self.thread or thread.ident not in frames:
+                    continue
+
+                stack = []
+                frame = frames[thread.ident]
+
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("{0} ({1}:{2})".format(code.co_name, os.path.basename(code.co_filename), frame.f_lineno))
+                    frame = frame.f_back
+
+                self.samples[thread.name][";".join(reversed(stack))] += 1
+
+    def dump(self):
+        """ Writes a profile per thread to the output directory, returning the paths written """
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        paths = []
+
+        with self.lock:
+            samples = {name: Counter(stacks) for name, stacks in self.samples.items()}
+
+        for thread_name, stacks in samples.items():
+            path = os.path.join(self.output_dir, "{0}-{1}.folded".format(thread_name, timestamp))
+
+            with open(path, "wt") as profile_file:
+                for stack, count in stacks.most_common():
+                    profile_file.write("{0} {1}\n".format(stack, count))
+
+            paths.append(path)
+
+        self.logger.info("Wrote %s profile(s) to %s", len(paths), self.output_dir)
+        return paths
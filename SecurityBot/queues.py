@@ -0,0 +1,155 @@
+from queue import Empty
+from collections import Counter
+
+import time
+import heapq
+import itertools
+import threading
+
+from SecurityBot import clock
+
+PRIORITY_ALARM = 0
+PRIORITY_REPLY = 1
+PRIORITY_NOTICE = 2
+
+
+class MessageQueue(object):
+    """
+    A bounded priority queue for passing messages between interfaces, a drop in for queue.Queue
+
+    Messages may carry a 'priority' (defaulting to PRIORITY_REPLY) and a 'coalesce_key', a message with the same
+    coalesce_key as one still queued replaces it rather than queueing behind it
+
+    When the queue is full:
+     * stale replies (queued longer than reply_ttl) are shed first
+     * then the lowest priority message, if it is lower priority than the one being added
+     * otherwise the message being added is dropped
+    Alarm messages are never dropped, they are queued even if the queue is over its bound
+    """
+    def __init__(self, maxsize=100, reply_ttl=60):
+        self.maxsize = maxsize
+        self.reply_ttl = reply_ttl
+
+        # Entries are [priority, sequence, queued_at, message], a shed entry has its message set to None
+        self.heap = []
+        self.size = 0
+        self.coalesce_keys = {}
+        self.sequence = itertools.count()
+
+        self.dropped = Counter()
+        self.coalesced = 0
+
+        self.not_empty = threading.Condition(threading.Lock())
+
+    def qsize(self):
+        return self.size
+
+    def empty(self):
+        return self.size == 0
+
+    def full(self):
+        return self.size >= self.maxsize
+
+    def stats(self):
+        """ The current depth, how many messages have been dropped (by reason) and how many were coalesced """
+        with self.not_empty:
+            return {
+                "depth": self.size,
+                "dropped": dict(self.dropped),
+                "coalesced": self.coalesced,
+            }
+
+    def put(self, message, block=True, timeout=None):
+        """ Never blocks, block and timeout are only accepted for compatibility with queue.Queue """
+        priority = message.get("priority", PRIORITY_REPLY)
+        coalesce_key = message.get("coalesce_key")
+
+        with self.not_empty:
+            if coalesce_key is not None and coalesce_key in self.coalesce_keys:
+                self.coalesce_keys[coalesce_key][3] = message
+                self.coalesced += 1
+                return
+
+            if self.size >= self.maxsize and not self.make_room(priority):
+                self.dropped["overflow"] += 1
+                return
+
+            entry = [priority, next(self.sequence), clock.monotonic(), message]
+            heapq.heappush(self.heap, entry)
+            self.size += 1
+
+            if coalesce_key is not None:
+                self.coalesce_keys[coalesce_key] = entry
+
+            self.not_empty.notify()
+
+    def put_nowait(self, message):
+        return self.put(message, block=False)
+
+    def make_room(self, priority):
+        """ Sheds one queued message to make room for a message of the given priority, returns False if we can't """
+        stale_before = clock.monotonic() - self.reply_ttl
+        live = [entry for entry in self.heap if entry[3] is not None]
+
+        stale = [entry for entry in live if entry[0] == PRIORITY_REPLY and entry[2] < stale_before]
+
+        if stale:
+            self.shed(min(stale, key=lambda entry: entry[2]), "stale")
+            return True
+
+        # The newest of the lowest priority messages
+        victim = max(live, key=lambda entry: (entry[0], entry[1]), default=None)
+
+        if victim is not None and victim[0] > priority:
+            self.shed(victim, "shed")
+            return True
+
+        # Alarms go in regardless of the bound
+        return priority == PRIORITY_ALARM
+
+    def shed(self, entry, reason):
+        coalesce_key = entry[3].get("coalesce_key")
+
+        if self.coalesce_keys.get(coalesce_key) is entry:
+            del self.coalesce_keys[coalesce_key]
+
+        entry[3] = None
+        self.size -= 1
+        self.dropped[reason] += 1
+
+        # Shed entries stay in the heap until they're popped, so compact it if a backlog has built up
+        if len(self.heap) > 2 * max(self.size, self.maxsize):
+            self.heap = [entry for entry in self.heap if entry[3] is not None]
+            heapq.heapify(self.heap)
+
+    def get(self, block=True, timeout=None):
+        with self.not_empty:
+            if block:
+                deadline = None if timeout is None else time.monotonic() + timeout
+
+                while not self.size:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+
+                    if remaining is not None and remaining <= 0:
+                        raise Empty
+
+                    self.not_empty.wait(remaining)
+            elif not self.size:
+                raise Empty
+
+            while True:
+                _, _, _, message = heapq.heappop(self.heap)
+
+                if message is not None:
+                    break
+
+            self.size -= 1
+
+            coalesce_key = message.get("coalesce_key")
+            if coalesce_key is not None and coalesce_key in self.coalesce_keys:
+                del self.coalesce_keys[coalesce_key]
+
+            return message
+
+    def get_nowait(self):
+        return self.get(block=False)
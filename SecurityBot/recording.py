@@ -0,0 +1,63 @@
+from datetime import datetime
+
+import gzip
+import json
+import time
+import threading
+
+
+class Recorder(object):
+    """
+    Captures inbound traffic (RTM events, ZoneMinder HTTP responses, etc) to a gzipped JSON lines file
+    Each record is {"t": seconds since recording started, "source": interface, "kind": type of record, "data": ...}
+    The capture can be fed back through the interfaces with SecurityBot.replay
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.capture_file = gzip.open(path, "wt")
+
+        self.record("recorder", "header", {"started": datetime.utcnow().isoformat()})
+
+    def record(self, source, kind, data):
+        line = json.dumps({
+            "t": round(time.monotonic() - self.started, 6),
+            "source": source,
+            "kind": kind,
+            "data": data,
+        }, separators=(",", ":"), default=str)
+
+        with self.lock:
+            if not self.capture_file.closed:
+                self.capture_file.write(line + "\n")
+
+    def record_response(self, source):
+        """ Returns a requests response hook that records every response seen by a session """
+        def hook(response, *args, **kwargs):
+            self.record(source, "http", {
+                "method": response.request.method,
+                "url": response.request.url,
+                "status": response.status_code,
+                "body": response.text,
+            })
+
+        return hook
+
+    def close(self):
+        with self.lock:
+            self.capture_file.close()
+
+
+def load_recording(path):
+    """ Reads every record from a capture, a capture cut short (eg. the process was killed) is read up to the cut """
+    records = []
+
+    with gzip.open(path, "rt") as capture_file:
+        try:
+            for line in capture_file:
+                records.append(json.loads(line))
+        except (EOFError, ValueError):
+            pass
+
+    return records
@@ -0,0 +1,81 @@
+import threading
+
+# Slack truncates messages past 40,000 characters and recommends keeping them under 4,000
+MAX_MESSAGE_LENGTH = 4000
+
+
+def render_table(title, row_format, headings, rows, footer=None, max_length=MAX_MESSAGE_LENGTH):
+    """
+    Renders rows as a code block table under a title
+    Tables too long for one message are split over as many as it takes, each with the title and headings repeated
+    :param title: Shown above the table, without the trailing colon
+    :param row_format: Format string for a single row, eg "{0:<15}{1:<10}"
+    :param headings: The heading row, formatted with row_format
+    :param rows: Each row, formatted with row_format
+    :param footer: A line to end the table with, eg "... and 10 more"
+    :param max_length: Most characters in any one message
+    :return: A list of message texts
+    """
+    heading = row_format.format(*headings)
+    lines = [row_format.format(*row) for row in rows]
+
+    if footer is not None:
+        lines.append(footer)
+
+    # Room for rows once the title (with a page count), headings and code block are in
+    room = max_length - len(title) - len(" (page 000/000):\n```\n```") - len(heading) - 1
+
+    pages = []
+    page = []
+    page_length = 0
+
+    for line in lines:
+        if page and page_length + len(line) + 1 > room:
+            pages.append(page)
+            page = []
+            page_length = 0
+
+        page.append(line)
+        page_length += len(line) + 1
+
+    pages.append(page)
+
+    if len(pages) == 1:
+        return ["{0}:\n```{1}\n```".format(title, "\n".join([heading] + pages[0]))]
+
+    return [
+        "{0} (page {1}/{2}):\n```{3}\n```".format(title, number, len(pages), "\n".join([heading] + page))
+        for number, page in enumerate(pages, start=1)
+    ]
+
+
+class RenderCache(object):
+    """
+    Rendered replies, kept until the data they were rendered from changes
+    Each reply is cached under a key with the version of the data it was rendered from, asking for a newer version
+    renders it again
+    """
+    def __init__(self):
+        self.rendered = {}
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version, render, *args):
+        """ The reply cached under key if it's still at version, otherwise the result of render(*args) """
+        with self.lock:
+            cached = self.rendered.get(key)
+
+            if cached is not None and cached[0] == version:
+                self.hits += 1
+                return cached[1]
+
+            self.misses += 1
+
+        reply = render(*args)
+
+        with self.lock:
+            self.rendered[key] = (version, reply)
+
+        return reply
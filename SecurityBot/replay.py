@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+from collections import defaultdict
+
+import json
+import time
+import bisect
+import logging
+import argparse
+import requests
+import threading
+
+from SecurityBot import clock
+from SecurityBot.main import parse_config
+from SecurityBot.queues import MessageQueue
+from SecurityBot.recording import load_recording
+from SecurityBot.human_interfaces.slack import SlackInterface
+from SecurityBot.security_interfaces.zoneminder import ZoneMinderInterface
+
+
+class ReplayClock(object):
+    """ Maps capture time onto the bot's clock, starting from the moment it's created """
+    def __init__(self):
+        self.started = clock.monotonic()
+
+    def now(self):
+        """ The current capture time """
+        return clock.monotonic() - self.started
+
+
+class ReplaySlackClient(object):
+    """ Stands in for SlackClient, handing out the captured RTM events as the clock reaches them """
+    def __init__(self, records, replay_clock):
+        self.events = [record for record in records if record["kind"] == "rtm"]
+        self.replay_clock = replay_clock
+        self.position = 0
+        self.lock = threading.Lock()
+
+        # Every call the bot made, in the order it made them
+        self.calls = []
+
+    def rtm_connect(self):
+        return True
+
+    def rtm_read(self):
+        now = self.replay_clock.now()
+        events = []
+
+        while self.position < len(self.events) and self.events[self.position]["t"] <= now:
+            events.append(self.events[self.position]["data"])
+            self.position += 1
+
+        return events
+
+    def api_call(self, method, **kwargs):
+        with self.lock:
+            self.calls.append({"t": self.replay_clock.now(), "method": method, "arguments": kwargs})
+            ts = "{0:.6f}".format(len(self.calls))
+
+        return {"ok": True, "ts": ts, "channel": kwargs.get("channel")}
+
+    def finished(self):
+        return self.position >= len(self.events)
+
+
+class ReplayResponse(object):
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class ReplaySession(object):
+    """
+    Stands in for a requests.Session, answering each request with the latest captured response to the same
+    method and URL at the current capture time (or the earliest one, if the clock hasn't reached any yet)
+    """
+    def __init__(self, records, replay_clock):
+        self.replay_clock = replay_clock
+        self.responses = defaultdict(list)
+        self.hooks = {"response": []}
+
+        for record in records:
+            if record["kind"] == "http":
+                data = record["data"]
+                self.responses[(data["method"], data["url"])].append((record["t"], data["status"], data["body"]))
+
+        self.times = {key: [t for t, _, _ in responses] for key, responses in self.responses.items()}
+
+    def request(self, method, url, params=None):
+        # Build the URL exactly as requests would have when it was captured
+        key = (method, requests.Request(method, url, params=params).prepare().url)
+
+        if key not in self.responses:
+            return ReplayResponse(404, "{}")
+
+        index = max(bisect.bisect_right(self.times[key], self.replay_clock.now()) - 1, 0)
+        _, status, body = self.responses[key][index]
+
+        return ReplayResponse(status, body)
+
+    def get(self, url, params=None, **_):
+        return self.request("GET", url, params)
+
+    def post(self, url, **_):
+        return self.request("POST", url)
+
+    def close(self):
+        pass
+
+
+def advance_when_idle(virtual_clock, replay_clock, interfaces, times, step, until, stop_event):
+    """
+    Drives a VirtualClock through a capture, moving it on only once every interface has gone round its loop at the
+    current time, to the next captured record or by `step`, whichever is sooner, so the bot's own timers still fire
+    :param times: Every time in the capture a record was taken at, sorted
+    :param step: Most capture seconds to move on by at once, the bot's poll interval
+    :param until: The capture time to stop at
+    """
+    while replay_clock.now() < until and not stop_event.is_set():
+        # Two iterations so we know a whole one has run since we last moved the clock
+        iterations = [interface.loop_timer.iterations for interface in interfaces]
+
+        while any(interface.loop_timer.iterations < seen + 2 for interface, seen in zip(interfaces, iterations)):
+            if stop_event.wait(0.001):
+                return
+
+        now = replay_clock.now()
+        next_record = times[bisect.bisect_right(times, now)] if times and times[-1] > now else until
+
+        virtual_clock.advance(min(next_record - now, step, until - now))
+
+
+def replay(config, records, speed, logger):
+    """
+    Feeds a capture back through a SlackInterface and ZoneMinderInterface built from the config
+    The bot runs on a clock sped up by `speed`, or at speed 0 on a virtual clock that moves on as soon as it's idle
+    :return: The Slack calls the bot made and the interfaces (for their loop timers/etc)
+    """
+    previous_clock = clock.current
+    virtual_clock = clock.VirtualClock() if not speed else None
+    clock.set_clock(virtual_clock or clock.SimulatedClock(speed))
+
+    try:
+        return replay_on_clock(config, records, speed, virtual_clock, logger)
+    finally:
+        clock.set_clock(previous_clock)
+
+
+def replay_on_clock(config, records, speed, virtual_clock, logger):
+    replay_clock = ReplayClock()
+
+    # Keep the replay self contained, no event socket or on disk event index
+    zoneminder_config = dict(config["security_interface"], event_socket=None, history_database=":memory:")
+
+    slack_configs = config["human_interface"]
+    if isinstance(slack_configs, dict):
+        slack_configs = [slack_configs]
+
+    slack_config = [c for c in slack_configs if c["name"] == SlackInterface.name][0]
+
+    human_interface_queue = MessageQueue()
+    security_interface_queue = MessageQueue()
+
+    zoneminder = ZoneMinderInterface(zoneminder_config, config["permissions"], config["locations"],
+                                     (human_interface_queue, security_interface_queue), logger)
+    zoneminder.session = zoneminder.history_session = ReplaySession(records, replay_clock)
+    zoneminder.command_sessions = [zoneminder.session] * zoneminder.command_workers
+
+    slack = SlackInterface(slack_config, config["users"], (security_interface_queue, human_interface_queue),
+                           zoneminder.get_commands(), logger)
+    slack.slack_client = ReplaySlackClient(records, replay_clock)
+    slack.ready = True
+
+    # The loops wait in wall time, on a virtual clock they just go round again and the clock is moved on for them
+    step = zoneminder.poll_interval
+    zoneminder.poll_interval = zoneminder.poll_interval / speed if speed else 0.001
+    slack.web_socket_sleep_delay = slack.web_socket_sleep_delay / speed if speed else 0.001
+
+    for record in records:
+        if record["kind"] == "ready" and record["source"] == slack.interface_id:
+            slack.bot_id = record["data"]["bot_id"]
+            slack.channel_id = record["data"]["channel_id"]
+
+    stop_event = threading.Event()
+    threads = [
+        threading.Thread(target=zoneminder.monitor, args=(stop_event,), name=zoneminder.name),
+        threading.Thread(target=slack.monitor, args=(stop_event,), name=slack.interface_id),
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    # Run until we're past the end of the capture and the bot has had a moment (of capture time) to respond to it
+    until = (records[-1]["t"] if records else 0) + 5
+
+    try:
+        if virtual_clock:
+            times = sorted(set(record["t"] for record in records))
+            advance_when_idle(virtual_clock, replay_clock, (zoneminder, slack), times, step, until, stop_event)
+        else:
+            while replay_clock.now() < until or not slack.slack_client.finished():
+                time.sleep(0.01)
+    finally:
+        stop_event.set()
+
+        for thread in threads:
+            thread.join()
+
+    return slack.slack_client.calls, (slack, zoneminder)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a capture taken with 'SecurityBot.main --record'")
+    parser.add_argument("capture", help="Path to the capture file")
+    parser.add_argument("--config", required=True, help="Path to the SecurityBot config file the capture was taken with")
+    parser.add_argument("--speed", type=float, default=1, help="Replay speed, 1 is real time and 0 is as fast as possible")
+    parser.add_argument("--output", help="Write the Slack calls the bot made here as JSON lines, eg. to diff runs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    logger = logging.getLogger("SecurityBot")
+
+    with open(args.config, "rt") as config_file:
+        config = parse_config(config_file)
+
+    records = load_recording(args.capture)
+    logger.info("Replaying %s records at %sx", len(records), args.speed or "max")
+
+    started = time.monotonic()
+    calls, interfaces = replay(config, records, args.speed, logger)
+    logger.info("Replay took %.1fs, the bot made %s Slack calls", time.monotonic() - started, len(calls))
+
+    for interface in interfaces:
+        timer = interface.loop_timer
+        logger.info("%s: %s loops, %s over budget, last took %.3fs",
+                    timer.name, timer.iterations, timer.over_budget, timer.last_duration or 0)
+
+    if args.output:
+        with open(args.output, "wt") as output_file:
+            for call in calls:
+                output_file.write(json.dumps(call, default=str) + "\n")
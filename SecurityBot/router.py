@@ -0,0 +1,80 @@
+from queue import Empty
+
+import threading
+
+from SecurityBot.profiling import LoopTimer
+
+
+class MessageRouter(object):
+    """
+    Publish/subscribe routing from the security interface out to every human interface
+    Replies to a command (messages whose options name an 'interface') go back only to the interface that sent the
+    command, anything else (alarms, digests, etc) goes to every subscriber
+
+    Each subscriber has its own queue that it reads from on its own thread, and putting onto a MessageQueue never
+    blocks, so a slow or hung subscriber only ever backs up its own queue. Producers that can hold off (eg. the
+    ZoneMinder hook listener) should check full() instead of the inbound queue, which we keep drained
+
+    It runs under the supervisor like an interface does
+    """
+    name = "router"
+
+    # Seconds routing a single message should take before we warn about it
+    loop_budget = 1
+
+    def __init__(self, inbound_queue, logger):
+        self.inbound_queue = inbound_queue
+        self.logger = logger.getChild(self.name)
+        self.subscribers = {}
+        self.lock = threading.Lock()
+
+        self.loop_timer = LoopTimer(self.name, self.loop_budget, self.logger)
+
+    def subscribe(self, interface_id, queue):
+        with self.lock:
+            self.subscribers[interface_id] = queue
+
+    def unsubscribe(self, interface_id):
+        with self.lock:
+            self.subscribers.pop(interface_id, None)
+
+    def full(self):
+        """ Whether the inbound queue or any subscriber's queue is at its bound """
+        with self.lock:
+            queues = [self.inbound_queue] + list(self.subscribers.values())
+
+        return any(queue.full() for queue in queues)
+
+    def is_ready(self):
+        return True
+
+    def route(self, message):
+        reply_to = message["options"].get("interface")
+
+        with self.lock:
+            if reply_to is None:
+                subscribers = list(self.subscribers.items())
+            elif reply_to in self.subscribers:
+                subscribers = [(reply_to, self.subscribers[reply_to])]
+            else:
+                self.logger.warning("Dropping a reply to unknown interface '%s'", reply_to)
+                return
+
+        for interface_id, queue in subscribers:
+            # Each subscriber gets its own copy as interfaces fill in their own options (eg. the channel)
+            queue.put(dict(message, options=dict(message["options"])))
+
+    def monitor(self, stop_event=None):
+        if stop_event is None:
+            stop_event = threading.Event()
+
+        while not stop_event.is_set():
+            try:
+                message = self.inbound_queue.get(timeout=1)
+            except Empty:
+                # Idle isn't hung
+                self.loop_timer.beat()
+                continue
+
+            with self.loop_timer:
+                self.route(message)
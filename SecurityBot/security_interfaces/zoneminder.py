@@ -1,23 +1,65 @@
 #!/usr/bin/env python3
 
-from queue import Empty
+from queue import Empty, Queue
 from collections import defaultdict
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 import re
 import os
-import time
+import sys
 import json
 import glob
-import signal
+import socket
 import requests
 import argparse
+import tempfile
 import itertools
-import subprocess
+import selectors
+import threading
+
+from SecurityBot import clock
+from SecurityBot.queues import PRIORITY_ALARM, PRIORITY_REPLY
+from SecurityBot.profiling import LoopTimer
+from SecurityBot.throttle import CommandThrottle, SingleFlight
+from SecurityBot.aggregation import AlarmAggregator
+from SecurityBot.rendering import RenderCache, render_table
+from SecurityBot.security_interfaces.zoneminder_events import ZoneMinderEventIndex, DEFAULT_EVENT_DATABASE
+
+DEFAULT_EVENT_SOCKET="/tmp/securitybot.sock"
+DEFAULT_EVENT_SEND_TIMEOUT=5
+DEFAULT_EVENT_SPOOL="/tmp/zm_events"
+
+TIME_REGEX = re.compile(r"^([0-9]+)([dhms])$")
+
+DELTA_UNITS = {
+    's': lambda x: timedelta(seconds=x),
+    'm': lambda x: timedelta(minutes=x),
+    'h': lambda x: timedelta(hours=x),
+    'd': lambda x: timedelta(days=x),
+}
+
+
+def parse_timedelta(value):
+    """ Parses a time setting like '5m' or '12h' into a timedelta, returning None if it's not valid """
+    match = TIME_REGEX.match(value)
+
+    if not match:
+        return None
+
+    amount, unit = match.groups()
+    return DELTA_UNITS[unit](int(amount))
+
+
+def format_timedelta(delta):
+    """ The reverse of parse_timedelta, using the largest unit that represents the delta exactly """
+    seconds = int(delta.total_seconds())
+
+    for unit, unit_seconds in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds and seconds % unit_seconds == 0:
+            return "{0}{1}".format(seconds // unit_seconds, unit)
+
+    return "{0}s".format(seconds)
 
-DEFAULT_SIGNAL=signal.SIGUSR1
-DEFAULT_PID_FILE="/tmp/securitybot.pid"
-DEFAULT_EVENT_FOLDER="/tmp/zm_events"
 
 class ZoneMinderInterface(object):
     name = "zoneminder"
@@ -25,54 +67,109 @@ class ZoneMinderInterface(object):
     ALARM_INACTIVE = 0
     ALARM_ACTIVE = 2
 
+    # Seconds between polling sweeps of every monitor
+    poll_interval = 1
+
+    # Commands are executed on their own lanes (each with its own session) so a slow sweep never delays them and vice
+    # versa, commands for the same monitor always share a lane so they run one at a time in the order they came in
+    command_workers = 4
+
+    # Most hook events we will read off the event socket before posting them as one message
+    event_batch_size = 50
+
+    # Most events a single history reply will list
+    history_limit = 20
+
+    # Most pages of events a single pass of the history sync will fetch, it carries straight on while catching up
+    history_sync_pages = 10
+
+    # Seconds a single polling sweep should take before we warn about it
+    loop_budget = 10
+
+    # Seconds before we give up on any single request to ZoneMinder
+    request_timeout = 5
+
+    # Set to a Recorder to capture every response from ZoneMinder
+    recorder = None
+
+    # Commands per second (and burst sizes) allowed for each user and for everyone combined
+    user_command_rate = 0.2
+    user_command_burst = 5
+    global_command_rate = 1
+    global_command_burst = 10
+
     def __init__(self, config, permissions, locations, queues, logger):
         self.config = config
         self.permissions = defaultdict(list)
         self.locations = dict()
         self.monitors = dict()
         self.read_queue, self.write_queue = queues
-        self.logger = logger
+        self.logger = logger.getChild(self.name)
+
+        # Anything with a full() we stop reading hook events while it's full, main.py hands us the router so that
+        # it's the human interfaces' queues that hold the hook back
+        self.backpressure = self.write_queue
 
         self.alarms = {}
+        self.alarms_lock = threading.RLock()
+
+        # Bumped whenever an alarm changes, so cached status replies know when they're stale
+        self.alarms_version = 0
+
+        # Permissions, locations and commands are only loaded once, so their replies are rendered once
+        self.rendered = RenderCache()
+
+        self.poll_interval = self.config.get("poll_interval", self.poll_interval)
+        self.command_workers = self.config.get("command_workers", self.command_workers)
+        self.event_socket = self.config.get("event_socket", DEFAULT_EVENT_SOCKET)
+        self.event_spool = self.config.get("event_spool", DEFAULT_EVENT_SPOOL)
+        self.event_batch_size = self.config.get("event_batch_size", self.event_batch_size)
+        self.loop_timer = LoopTimer(self.name, self.config.get("loop_budget", self.loop_budget), self.logger)
+        self.request_timeout = self.config.get("request_timeout", self.request_timeout)
+        self.history_sync_pages = self.config.get("history_sync_pages", self.history_sync_pages)
+
+        # Protect ZoneMinder (and the sweep that shares it) from command floods
+        self.command_throttle = CommandThrottle(self.config.get("user_command_rate", self.user_command_rate),
+                                                self.config.get("user_command_burst", self.user_command_burst),
+                                                self.config.get("global_command_rate", self.global_command_rate),
+                                                self.config.get("global_command_burst", self.global_command_burst))
+        self.in_flight = SingleFlight()
 
         # Ensure a consistent URL format
         while self.config["url"].endswith("/"):
             self.config["url"] = self.config["url"][0:-1]
 
         # Check each delta setting and parse it
-        time_regex = re.compile(r"^([0-9]+)([hms])$")
-
-        delta_dict = {
-            's': lambda x: timedelta(seconds=x),
-            'm': lambda x: timedelta(minutes=x),
-            'h': lambda x: timedelta(hours=x),
-        }
-
         delta_defaults = {
             "alarm_alert_interval": timedelta(minutes=1),
             "alarm_expires_at": timedelta(minutes=5),
+            "alarm_digest_window": timedelta(seconds=2),
+            "alarm_digest_max_age": timedelta(minutes=10),
+            "history_sync_interval": timedelta(minutes=1),
+            "history_window": timedelta(hours=12),
+            "history_retention": timedelta(days=30),
+            "alarm_retention": timedelta(days=1),
         }
 
-        for setting_name in ["alarm_alert_interval", "alarm_expires_at"]:
+        for setting_name in delta_defaults.keys():
             use_default = False
 
-            if self.config[setting_name]:
-                match = time_regex.match(self.config[setting_name])
+            if self.config.get(setting_name):
+                delta = parse_timedelta(self.config[setting_name])
 
-                if match:
-                    alert_interval, alert_delta = match.group()
-                    self.config[setting_name] = delta_dict[alert_delta](int(alert_interval))
+                if delta is not None:
+                    self.config[setting_name] = delta
                 else:
                     use_default = True
-                    self.logger.error("Invalid '{0}' value".format(setting_name))
+                    self.logger.error("Invalid '%s' value", setting_name)
             else:
                 use_default = True
                 self.config[setting_name] = delta_defaults[setting_name]
-                self.logger.warn("'{0}' is missing from config".format(setting_name, self.config[setting_name]))
+                self.logger.warning("'%s' is missing from config", setting_name)
 
             if use_default:
                 self.config[setting_name] = delta_defaults[setting_name]
-                self.logger.warn("Loading default: {1}".format(setting_name, self.config[setting_name]))
+                self.logger.warning("Loading default for '%s': %s", setting_name, self.config[setting_name])
 
         # Parse and load all the permissions
         for permission in permissions:
@@ -95,6 +192,9 @@ class ZoneMinderInterface(object):
                 for option in options:
                     self.permissions[common_id].append((command, option))
 
+        # Slack lowercases whole messages, so the users named in commands are looked up by their lowercased common ID
+        self.common_ids = dict((common_id.lower(), common_id) for common_id in self.permissions)
+
         # Parse and load all the locations
         for location_string in locations:
             interface, location, monitor_id = location_string.split(':')
@@ -127,15 +227,20 @@ class ZoneMinderInterface(object):
                 "num_args": range(1, 4),
                 "help": "Shows the status of the location, eg 'status apartment'"
             },
+            "history": {
+                "function": self.history_location,
+                "num_args": range(1, 5),
+                "help": "Shows recent events at a location, eg 'history apartment 12h'",
+            },
             "permissions": {
                 "function": self.list_permissions,
-                "num_args": range(0),
-                "help": "Shows all the loaded permissions for ZoneMinder",
+                "num_args": range(0, 2),
+                "help": "Shows the loaded permissions for ZoneMinder, optionally just a user's, eg 'permissions bob'",
             },
             "locations": {
                 "function": self.list_locations,
-                "num_args": range(0),
-                "help": "Shows all the loaded locations for ZoneMinder",
+                "num_args": range(0, 4),
+                "help": "Shows the loaded locations for ZoneMinder, optionally just one, eg 'locations apartment'",
             },
             "help": {
                 "function": self.list_commands,
@@ -144,12 +249,37 @@ class ZoneMinderInterface(object):
             },
         }
 
+        # The sweep, each command lane and the history sync have their own session, so they never wait on each
+        # other's connections, and no session is used from more than one thread
         self.session = None
+        self.command_sessions = []
+        self.history_session = None
+
+        # Alarm state changes are merged into digests so a storm doesn't flood the channel
+        self.aggregator = AlarmAggregator(self.config["alarm_digest_window"], self.write_queue, name=self.name,
+                                          max_age=self.config["alarm_digest_max_age"])
+
+        # A local index of ZoneMinder events, the history command reads from this rather than ZoneMinder
+        self.event_index = ZoneMinderEventIndex(self.config.get("history_database", DEFAULT_EVENT_DATABASE), self.logger)
+        self.event_index_synced_at = None
 
     def get_commands(self):
         return self.commands
 
     def connect_to_zm(self):
+        # Always start from fresh sessions, we're called again to reconnect whenever we're restarted
+        for session in [self.session, self.history_session] + self.command_sessions:
+            if session is not None:
+                session.close()
+
+        self.session = self.log_in()
+        self.command_sessions = [self.log_in() for _ in range(self.command_workers)]
+        self.history_session = self.log_in()
+
+        return None not in [self.session, self.history_session] + self.command_sessions
+
+    def log_in(self):
+        """ Logs a new session into ZoneMinder, returning None if we couldn't """
         auth_url = "{0}/index.php".format(self.config["url"])
         auth_payload = {
             "username": self.config["username"],
@@ -158,27 +288,31 @@ class ZoneMinderInterface(object):
             "view": "console",
         }
 
-        self.session = requests.Session()
-        auth_response = self.session.post(auth_url, data=auth_payload)
+        session = requests.Session()
+
+        if self.recorder:
+            session.hooks["response"].append(self.recorder.record_response(self.name))
+
+        auth_response = session.post(auth_url, data=auth_payload, timeout=self.request_timeout)
 
         if auth_response.status_code != requests.codes.ok:
             self.logger.error("Received a bad status code from ZoneMinder while authenticating")
-            return False
+            return None
 
         # Test out our authentication against an endpoint
         monitors_url = "{0}/api/monitors.json".format(self.config["url"])
-        monitors_response = self.session.get(monitors_url)
+        monitors_response = session.get(monitors_url, timeout=self.request_timeout)
 
         if monitors_response.status_code != requests.codes.ok:
             self.logger.error("Failed to log into Zoneminder correctly")
-            return False
+            return None
 
-        return True
+        return session
 
     def status_of_monitor(self, monitor_id, location):
         endpoint = "{0}/api/monitors/alarm/id:{1}/command:status.json".format(self.config["url"], monitor_id)
 
-        monitor_status_response = self.session.get(endpoint)
+        monitor_status_response = self.session.get(endpoint, timeout=self.request_timeout)
 
         if monitor_status_response.status_code != requests.codes.ok:
             return "Failed to get the status of {0}, sorry :sob:".format(location.title())
@@ -196,7 +330,7 @@ class ZoneMinderInterface(object):
             "Monitor[Enabled]": 1,
         }
 
-        arm_response = self.session.post(endpoint, data=payload)
+        arm_response = self.command_sessions[self.command_lane_for(monitor_id)].post(endpoint, data=payload, timeout=self.request_timeout)
 
         if arm_response.status_code != requests.codes.ok:
             return "Failed to arm {0}, sorry :sob:".format(location.title())
@@ -211,7 +345,7 @@ class ZoneMinderInterface(object):
             "Monitor[Enabled]": 1,
         }
 
-        disarm_response = self.session.post(endpoint, data=payload)
+        disarm_response = self.command_sessions[self.command_lane_for(monitor_id)].post(endpoint, data=payload, timeout=self.request_timeout)
 
         if disarm_response.status_code != requests.codes.ok:
             return "Failed to disarm {0}, sorry :sob:".format(location.title())
@@ -265,7 +399,8 @@ class ZoneMinderInterface(object):
 
         monitor_id = self.locations[location]
 
-        return self.arm_monitor(monitor_id, location)
+        # Identical requests that arrive together share the one call to ZoneMinder
+        return self.in_flight.do(("arm", monitor_id), self.arm_monitor, monitor_id, location)
 
     def disarm_location(self, options, common_id):
         command = "disarm"
@@ -281,7 +416,7 @@ class ZoneMinderInterface(object):
 
         monitor_id = self.locations[location]
 
-        return self.disarm_monitor(monitor_id, location)
+        return self.in_flight.do(("disarm", monitor_id), self.disarm_monitor, monitor_id, location)
 
     def ack_location(self, options, common_id):
         command = "ack"
@@ -300,15 +435,17 @@ class ZoneMinderInterface(object):
         return self.ack_alarm(monitor_id, location)
 
     def ack_alarm(self, monitor_id, location):
-        if monitor_id not in self.alarms:
-            return "Err, that location is not currently under attack :face_with_rolling_eyes:"
+        with self.alarms_lock:
+            if monitor_id not in self.alarms:
+                return "Err, that location is not currently under attack :face_with_rolling_eyes:"
 
-        alarm_details = self.alarms[monitor_id]
+            alarm_details = self.alarms[monitor_id]
 
-        if alarm_details["ack"]:
-            return "Err, you've already ack'd this alarm :face_with_rolling_eyes:"
+            if alarm_details["ack"]:
+                return "Err, you've already ack'd this alarm :face_with_rolling_eyes:"
 
-        alarm_details["ack"] = True
+            alarm_details["ack"] = True
+            self.alarms_version += 1
 
         return "Successfully ack'd alarm for {0}".format(location)
 
@@ -326,58 +463,162 @@ class ZoneMinderInterface(object):
 
         monitor_id = self.locations[location]
 
-        if monitor_id in self.alarms:
-            alarm = self.alarms[monitor_id]
+        with self.alarms_lock:
+            version = self.alarms_version
+            alarm = self.alarms.get(monitor_id)
 
-            if alarm["finished"]:
-                verb = "no longer"
-            else:
-                verb = "currently"
+            if alarm is not None:
+                alarm = dict(alarm)
 
-            response = "{0} is {1} under attack!\n\nHere are the details:\n```".format(location.title(), verb)
-            response += "Alarm Raised:   {0}\n".format(alarm["started"].strftime("%Y-%m-%d %H:%M:%S"))
-            response += "Alarm Updated:  {0}\n".format(alarm["updated"].strftime("%Y-%m-%d %H:%M:%S"))
-            response += "Alarm Finished: {0}\n".format(alarm["finished"])
-            response += "Ack'd? {0}```".format("Yes" if alarm["ack"] else "No")
+        return self.rendered.get(("status", location), version, self.render_status, location, alarm)
 
-            return response
-        else:
+    @staticmethod
+    def render_status(location, alarm):
+        if alarm is None:
             return "{0} is fine!".format(location.title())
 
-    def list_permissions(self, *_):
-        pretty_list = "These are the permissions I've loaded:\n```"
-        pretty_list += "{0:<15}{1:<10}{2:<10}\n".format("User", "Command", "Option")
+        if alarm["finished"]:
+            verb = "no longer"
+        else:
+            verb = "currently"
+
+        return "\n".join([
+            "{0} is {1} under attack!\n".format(location.title(), verb),
+            "Here are the details:",
+            "```Alarm Raised:   {0}".format(alarm["started"].strftime("%Y-%m-%d %H:%M:%S")),
+            "Alarm Updated:  {0}".format(alarm["updated"].strftime("%Y-%m-%d %H:%M:%S")),
+            "Alarm Finished: {0}".format(alarm["finished"]),
+            "Ack'd? {0}```".format("Yes" if alarm["ack"] else "No"),
+        ])
+
+    def history_location(self, options, common_id):
+        command = "history"
+        window = self.config["history_window"]
+
+        # The last option may be the window to look back over, eg 'history front door 2d'
+        if len(options) > 1 and parse_timedelta(options[-1]):
+            window = parse_timedelta(options[-1])
+            options = options[:-1]
 
-        for common_id, permissions in self.permissions.items():
-            for command, option in permissions:
-                pretty_list += "{0:<15}{1:<10}{2:<10}\n".format(common_id, command, option)
+        permission_failure = self.has_permissions(command, options, common_id, option_name="location")
 
-        pretty_list += "```"
-        return pretty_list
+        if permission_failure:
+            return permission_failure
 
-    def list_locations(self, *_):
-        pretty_list = "These are the locations I've loaded:\n```"
-        pretty_list += "{0:<20}{1:<10}\n".format("Location", "Monitor ID")
+        location = ' '.join(options)
 
-        for location, monitor_id in self.locations.items():
-            pretty_list += "{0:<20}{1:<10}\n".format(location, monitor_id)
+        if location not in self.locations:
+            return "Unknown location sorry!"
 
-        pretty_list += "```"
-        return pretty_list
+        total, events = self.event_index.query(self.locations[location], window, self.history_limit)
 
-    def list_commands(self, *_):
-        pretty_list = "These are the commands I support:\n```"
-        pretty_list += "{0:<15}{1:<10}\n".format("Command", "Help")
+        if not total:
+            return "Nothing has happened at {0} in the last {1}".format(location.title(), format_timedelta(window))
+
+        title = "{0} has had {1} event(s) in the last {2}".format(location.title(), total, format_timedelta(window))
+        rows = [(start_time, "{0}s".format(length), cause or notes or "") for start_time, length, cause, notes in events]
+        footer = "... and {0} more".format(total - len(events)) if total > len(events) else None
+
+        return render_table(title, "{0:<22}{1:<10}{2}", ("Started", "Length", "Cause"), rows, footer=footer)
+
+    def sync_event_index(self):
+        """
+        Syncs up to history_sync_pages pages of new events into the local event index
+        This happens every history_sync_interval, or straight away while we're still catching up with ZoneMinder
+        :return: False while we're still catching up
+        """
+        now = clock.utcnow()
 
-        for command, args in self.commands.items():
-            pretty_list += "{0:<15}{1:<10}\n".format(command, args["help"])
+        if self.event_index_synced_at and now - self.event_index_synced_at < self.config["history_sync_interval"]:
+            return True
 
-        pretty_list += "```"
-        return pretty_list
+        try:
+            caught_up = self.event_index.sync(self.history_session, self.config["url"], self.request_timeout,
+                                              self.history_sync_pages)
+        except (requests.RequestException, ValueError, KeyError):
+            self.logger.exception("Failed to sync ZoneMinder events")
+            caught_up = True
+
+        if caught_up:
+            self.event_index_synced_at = now
+            self.event_index.prune(self.config["history_retention"])
+
+        return caught_up
+
+    def history_sync(self, stop_event):
+        """
+        Keeps the event index synced on its own thread, so a first sync (or catching up after downtime) never holds up
+        alarm detection
+        :param stop_event: We stop syncing once this is set
+        :return:
+        """
+        backoff = self.poll_interval
+
+        while not stop_event.is_set():
+            cursor = self.event_index.cursor()
+
+            if self.sync_event_index():
+                backoff = self.poll_interval
+                stop_event.wait(self.poll_interval)
+            elif self.event_index.cursor() == cursor:
+                # Going straight round again would only repeat a pass that got us nowhere
+                self.logger.warning("The event index sync made no progress, retrying in %ss", backoff)
+                stop_event.wait(backoff)
+                backoff = min(backoff * 2, self.config["history_sync_interval"].total_seconds())
+            else:
+                backoff = self.poll_interval
+
+    def list_permissions(self, options, *_):
+        # Just the one user's permissions, read straight out of the index rather than filtering the whole table
+        if options:
+            common_id = self.common_ids.get(options[0].lower())
+
+            if common_id is None:
+                return "Unknown user sorry!"
+
+            return self.rendered.get(("permissions", common_id), 0, self.render_permissions, [common_id])
+
+        return self.rendered.get("permissions", 0, self.render_permissions, list(self.permissions.keys()))
+
+    def render_permissions(self, common_ids):
+        return render_table("These are the permissions I've loaded",
+                            "{0:<15}{1:<10}{2:<10}",
+                            ("User", "Command", "Option"),
+                            [(common_id, command, option)
+                             for common_id in common_ids
+                             for command, option in self.permissions[common_id]])
+
+    def list_locations(self, options, *_):
+        if options:
+            location = ' '.join(options)
+
+            if location not in self.locations:
+                return "Unknown location sorry!"
+
+            return self.rendered.get(("locations", location), 0, self.render_locations, [location])
+
+        return self.rendered.get("locations", 0, self.render_locations, list(self.locations.keys()))
+
+    def render_locations(self, locations):
+        return render_table("These are the locations I've loaded",
+                            "{0:<20}{1:<10}",
+                            ("Location", "Monitor ID"),
+                            [(location, self.locations[location]) for location in locations])
+
+    def list_commands(self, *_):
+        return self.rendered.get("commands", 0, self.render_commands)
+
+    def render_commands(self):
+        return render_table("These are the commands I support",
+                            "{0:<15}{1:<10}",
+                            ("Command", "Help"),
+                            [(command, args["help"]) for command, args in self.commands.items()])
 
     def check_monitors(self, status_filter):
         monitor_ids = []
         for location, monitor_id in self.locations.items():
+            self.loop_timer.beat()
+
             status = self.status_of_monitor(monitor_id, location)
 
             if status == status_filter:
@@ -386,22 +627,26 @@ class ZoneMinderInterface(object):
         return monitor_ids
 
     def expire_old_alarms(self):
-        for monitor_id, alarm_details in [(i, j) for (i, j) in self.alarms.items() if j["ack"]]:
+        with self.alarms_lock:
+            self._expire_old_alarms()
+
+    def _expire_old_alarms(self):
+        for monitor_id, alarm_details in list(self.alarms.items()):
             if not alarm_details["finished"]:
                 # Alarm is still considered active, ignore it
                 continue
 
-            alarm_expires_at = alarm_details["finished"] + self.config["alarm_expires_at"]
+            # Finished alarms nobody ack'd are kept around for longer, but not forever
+            if alarm_details["ack"]:
+                alarm_expires_at = alarm_details["finished"] + self.config["alarm_expires_at"]
+            else:
+                alarm_expires_at = alarm_details["finished"] + self.config["alarm_retention"]
 
-            if datetime.utcnow() > alarm_expires_at:
-                self.write_queue.put({
-                    "text": "{0}'s alarm has expired".format(self.monitors[monitor_id].title()),
-                    "options": {
-                        "channel": None
-                    }
-                })
+            if clock.utcnow() > alarm_expires_at:
+                self.aggregator.add(self.monitors[monitor_id], AlarmAggregator.EXPIRED)
 
                 del self.alarms[monitor_id]
+                self.alarms_version += 1
 
     def update_alarm(self, monitor_id):
         alarm_details = self.alarms[monitor_id]
@@ -412,68 +657,107 @@ class ZoneMinderInterface(object):
 
         alert_at = alarm_details["updated"] + self.config["alarm_alert_interval"]
 
-        if datetime.utcnow() > alert_at:
-            self.write_queue.put({
-                "text": "btw, {0} is still under attack!".format(self.monitors[monitor_id].title()),
-                "options": {
-                    "channel": None
-                }
-            })
+        if clock.utcnow() > alert_at:
+            alarm_details["updated"] = clock.utcnow()
+            self.alarms_version += 1
+            self.aggregator.add(self.monitors[monitor_id], AlarmAggregator.ONGOING)
 
     def finish_alarm(self, monitor_id):
-        self.alarms[monitor_id]["finished"] = True
-
-        self.write_queue.put({
-            "text": "{0} is no longer under attack!".format(self.monitors[monitor_id].title()),
-            "options": {
-                "channel": None
-            }
-        })
+        self.alarms[monitor_id]["finished"] = clock.utcnow()
+        self.alarms_version += 1
+        self.aggregator.add(self.monitors[monitor_id], AlarmAggregator.FINISHED)
 
     def new_alarm(self, monitor_id):
         self.alarms[monitor_id] = {
-            "started": datetime.utcnow(),
-            "updated": datetime.utcnow(),
+            "started": clock.utcnow(),
+            "updated": clock.utcnow(),
             "finished": None,
             "ack": False,
             "event_id": None,
         }
+        self.alarms_version += 1
 
-        self.write_queue.put({
-            "text": "Uhh ohh, {0} is under attack!".format(self.monitors[monitor_id]),
-            "options": {
-                "channel": None
-            }
-        })
+        self.aggregator.add(self.monitors[monitor_id], AlarmAggregator.RAISED)
 
-    def monitor(self):
-        self.logger.info("ZoneMinder is connected and looking for alarms")
+    def execute_command(self, message):
+        """ Runs a single command request on its command lane and writes the response back """
+        try:
+            command = self.commands[message["command"]]["function"]
+            response = command(message["options"], message["common_id"])
+
+            # Long replies come back as a list of messages, posted in order
+            if not isinstance(response, list):
+                response = [response]
+
+            for text in response:
+                self.write_queue.put({
+                    "text": text,
+                    "priority": PRIORITY_REPLY,
+                    "options": message["response_options"],
+                })
+            self.logger.debug("Writen to human read queue!")
+        except Exception:
+            self.logger.exception("Failed to execute command: %s", message)
+
+    def command_lane_for(self, key):
+        """ The command lane everything for key (a monitor ID, or the command if it isn't for a location) runs on """
+        return hash(key) % self.command_workers
+
+    def run_command_lane(self, lane, stop_event):
+        """ Runs the commands handed to a single lane, one at a time """
+        while not stop_event.is_set():
+            try:
+                message = lane.get(timeout=self.poll_interval)
+            except Empty:
+                continue
 
-        while True:
-            # Check ZoneMinder for any new alerts
-            # Parse the alert and extract a picture/frame
-            # Send the picture/alert/message into the write queue
+            self.execute_command(message)
+
+    def command_lane(self, stop_event):
+        """
+        Waits on the read queue and hands each command to its command lane as soon as it arrives
+        This runs separately to the polling sweep, and commands use their own sessions, so neither is ever stuck
+        behind the other. Commands for the same monitor go to the same lane, so eg. an arm and then a disarm can't
+        overtake each other
+        :param stop_event: The lanes exit once this is set
+        :return:
+        """
+        lanes = [Queue() for _ in range(self.command_workers)]
+
+        for number, lane in enumerate(lanes):
+            lane_thread = threading.Thread(target=self.run_command_lane, args=(lane, stop_event),
+                                           name="{0}-commands-{1}".format(self.name, number), daemon=True)
+            lane_thread.start()
+
+        while not stop_event.is_set():
             try:
-                message = self.read_queue.get(block=False)
-                self.logger.debug(message)
+                message = self.read_queue.get(timeout=self.poll_interval)
+            except Empty:
+                continue
 
-                command = self.commands[message["command"]]["function"]
-                response = command(message["options"], message["common_id"])
+            self.logger.debug("Command: %s", message, extra={"command": message.get("command")})
 
+            if not self.command_throttle.allow(message["common_id"]):
+                self.logger.warning("Throttled a command from %s", message["common_id"])
                 self.write_queue.put({
-                    "text": response,
+                    "text": "Whoa, slow down! Give me a moment before sending more commands :hourglass:",
+                    "priority": PRIORITY_REPLY,
                     "options": message["response_options"],
                 })
-                self.logger.debug("Writen to human read queue!")
-            except Empty:
-                pass
+                continue
+
+            key = self.locations.get(' '.join(message["options"]), message["command"])
+            lanes[self.command_lane_for(key)].put(message)
 
-            self.expire_old_alarms()
+    def sweep(self):
+        """ Checks every monitor for alarms and raises, updates or finishes our alarms to match """
+        self.expire_old_alarms()
 
-            alarmed_monitors = self.check_monitors(status_filter=self.ALARM_ACTIVE)
+        alarmed_monitors = self.check_monitors(status_filter=self.ALARM_ACTIVE)
 
+        with self.alarms_lock:
             for monitor_id in alarmed_monitors:
-                if monitor_id in self.alarms:
+                if monitor_id in self.alarms and not self.alarms[monitor_id]["finished"]:
                     self.update_alarm(monitor_id)
                 else:
                     self.new_alarm(monitor_id)
@@ -483,59 +767,206 @@ class ZoneMinderInterface(object):
                 if not self.alarms[monitor_id]["finished"]:
                     self.finish_alarm(monitor_id)
 
-            time.sleep(1)
+            self.aggregator.flush()
+
+    def monitor(self, stop_event=None):
+        """
+        Polls ZoneMinder for alarms until the stop event is set, running commands and hook events on their own threads
+        Alarm state lives on the interface, so a restarted monitor carries on from where the last one left off
+        :param stop_event:
+        :return:
+        """
+        if stop_event is None:
+            stop_event = threading.Event()
+
+        self.logger.info("ZoneMinder is connected and looking for alarms")
+
+        command_thread = threading.Thread(target=self.command_lane, args=(stop_event,),
+                                          name="{0}-commands".format(self.name), daemon=True)
+        command_thread.start()
+
+        history_thread = threading.Thread(target=self.history_sync, args=(stop_event,),
+                                          name="{0}-history".format(self.name), daemon=True)
+        history_thread.start()
+
+        if self.event_socket:
+            event_thread = threading.Thread(target=self.listen_for_events, args=(self.event_socket, stop_event),
+                                            name="{0}-events".format(self.name), daemon=True)
+            event_thread.start()
+
+        try:
+            while not stop_event.is_set():
+                # Check ZoneMinder for any new alerts
+                # Parse the alert and extract a picture/frame
+                # Send the picture/alert/message into the write queue
+                with self.loop_timer:
+                    self.sweep()
+
+                stop_event.wait(self.poll_interval)
+        finally:
+            # Take the command lane, history sync and event listener down with us
+            stop_event.set()
+
+    def read_events(self, event_socket):
+        """
+        Reads up to event_batch_size datagrams off the (non-blocking) event socket
+        :param event_socket:
+        :return: A list of the decoded events
+        """
+        events = []
+
+        while len(events) < self.event_batch_size:
+            try:
+                datagram = event_socket.recv(65536)
+            except BlockingIOError:
+                break
+
+            try:
+                events.append(json.loads(datagram.decode("utf-8")))
+            except ValueError:
+                self.logger.error("Received a malformed event from the hook: %s", datagram)
+
+        return events
+
+    def drain_spool(self):
+        """
+        Reads up to event_batch_size of the events the hook spooled (oldest first) while we weren't listening
+        :return: A list of the events, they're removed from the spool
+        """
+        if not os.path.isdir(self.event_spool):
+            return []
+
+        spooled = sorted(glob.glob(os.path.join(self.event_spool, "event-*.json")), key=os.path.getmtime)
+        events = []
+
+        for event_filename in spooled[:self.event_batch_size]:
+            try:
+                with open(event_filename, "rt") as event_file:
+                    events.append(json.load(event_file))
+            except ValueError:
+                self.logger.error("Removing a malformed spooled event: %s", event_filename)
+
+            os.remove(event_filename)
+
+        return events
+
+    def handle_events(self, events):
+        self.logger.info("Received %s new zoneminder event(s)", len(events))
+
+        self.write_queue.put({
+            "text": "\n".join("{0}".format(event) for event in events),
+            "priority": PRIORITY_ALARM,
+            "options": {
+                "channel": None
+            },
+        })
+
+    def listen_for_events(self, path=DEFAULT_EVENT_SOCKET, stop_event=None):
+        """
+        Listens on a unix datagram socket for events sent by the ZoneMinder hook (see send_event)
+        While self.backpressure is full we stop reading, the socket buffer fills up and the hook blocks
+        Events the hook couldn't send us (we weren't listening, or held it back past its timeout) are spooled to
+        self.event_spool, we read those whenever the socket is quiet, and spool anything left unread when we stop
+        :param path:
+        :param stop_event: We stop listening once this is set
+        :return:
+        """
+        if stop_event is None:
+            stop_event = threading.Event()
 
-    def write_pid(self, path=DEFAULT_PID_FILE):
         if os.path.exists(path):
             os.remove(path)
 
-        with open(path, "wt") as pid_file:
-            pid_file.write(os.getpid())
+        event_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        event_socket.bind(path)
+        event_socket.setblocking(False)
 
-    def handle_new_alarm(self, event_folder=DEFAULT_EVENT_FOLDER):
-        self.logger.info("Received signal that a new zoneminder event is available")
+        selector = selectors.DefaultSelector()
+        selector.register(event_socket, selectors.EVENT_READ)
 
-        # Read in each event file, we loop as there may be more than one
-        for event_filename in glob.glob(os.path.join(event_folder, "event-*.json")):
-            self.logger.info("Found: {0}".format(event_filename))
+        self.logger.info("Listening for ZoneMinder events on %s", path)
 
-            with open(event_filename, "rt") as event_file:
-                event = json.loads(event_file)
+        try:
+            while not stop_event.is_set():
+                if self.backpressure.full():
+                    # Apply backpressure to the hook by leaving the events in the socket buffer
+                    stop_event.wait(self.poll_interval)
+                    continue
+
+                if selector.select(timeout=self.poll_interval):
+                    events = self.read_events(event_socket)
+                else:
+                    events = self.drain_spool()
 
-                self.logger.info("Got event: {0}".format(event))
-                self.write_queue.put({
-                    "text": "{0}".format(event),
-                    "options": {
-                        "channel": None
-                    },
-                })
+                if events:
+                    self.handle_events(events)
+        finally:
+            # Hand anything still in the socket buffer over to the next listener
+            events = self.read_events(event_socket)
 
-            self.logger.info("Deleting {0}".format(event_filename))
-            os.remove(event_filename)
+            while events:
+                for event in events:
+                    spool_event(event, self.event_spool)
 
-    def listen_for_signal(self, sig=DEFAULT_SIGNAL):
-        # This will only fire in the main thread, so we're threadsafe on this firing
-        signal.signal(sig, handle_new_alarm)
+                events = self.read_events(event_socket)
 
+            selector.close()
+            event_socket.close()
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("alarm_folder", help="Path to alarm")
-    parser.add_argument("--pid-file", default=DEFAULT_PID_FILE, help="PID file we will send the signal to")
-    parser.add_argument("--event-folder", default=DEFAULT_EVENT_FOLDER, help="Folder we write out the event to")
-    args = parser.parse_args()
 
-    if not os.path.exists(args.pid_file):
-        parser.error("PID file '{0}' doesn't exist?".format(args.pid_file))
+def spool_event(event, spool=DEFAULT_EVENT_SPOOL):
+    """
+    Writes a single event to the spool folder for a SecurityBot to pick up once it's listening
+    The event is written under a temporary name and renamed into place, so it's never read half written
+    :param event: A JSON serializable dict
+    :param spool: The folder the bot reads spooled events from
+    :return: The spooled event's filename
+    """
+    os.makedirs(spool, exist_ok=True)
+
+    handle, temporary_filename = tempfile.mkstemp(prefix="event-", suffix=".json.tmp", dir=spool)
+
+    with os.fdopen(handle, "wt") as event_file:
+        json.dump(event, event_file)
 
-    with open(args.pid_file, "rt") as pid_file:
-        pid = int(pid_file.read())
+    event_filename = temporary_filename[:-len(".tmp")]
+    os.rename(temporary_filename, event_filename)
 
-    if not os.path.exists(args.event_folder):
-        os.makedirs(args.event_folder, exist_ok=True)
+    return event_filename
 
-    def trigger_signal(pid, sig=DEFAULT_SIGNAL):
-        subprocess.run(["kill", "-{0}".format(sig.name), str(pid)])
+
+def send_event(event, path=DEFAULT_EVENT_SOCKET, timeout=DEFAULT_EVENT_SEND_TIMEOUT, spool=DEFAULT_EVENT_SPOOL):
+    """
+    Sends a single event to a running SecurityBot over its event socket
+    The send blocks (up to timeout) while the bot is applying backpressure, if the bot isn't listening or the send
+    times out the event is spooled instead (see spool_event)
+    :param event: A JSON serializable dict
+    :param path: The event socket the bot is listening on
+    :param timeout: How long to wait for the bot to accept the event
+    :param spool: The folder to spool the event to if we can't send it
+    :return: True if the event was sent, False if it was spooled
+    """
+    event_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    event_socket.settimeout(timeout)
+
+    try:
+        event_socket.sendto(json.dumps(event).encode("utf-8"), path)
+        return True
+    except OSError:
+        # Not listening (no socket, or a stale one) or holding us back for too long, either way it'll get it later
+        spool_event(event, spool)
+        return False
+    finally:
+        event_socket.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("alarm_folder", help="Path to alarm")
+    parser.add_argument("--event-socket", default=DEFAULT_EVENT_SOCKET, help="Socket the SecurityBot listens for events on")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_EVENT_SEND_TIMEOUT, help="Seconds to wait for the SecurityBot")
+    parser.add_argument("--event-spool", default=DEFAULT_EVENT_SPOOL, help="Folder events are spooled to if the SecurityBot isn't listening")
+    args = parser.parse_args()
 
     event = {}
 
@@ -558,10 +989,9 @@ if __name__ == "__main__":
     event_id = event_ids[0].split("/")[-1].lstrip(".")
     event["event_id"] = event_id
 
-    # Write it out to disk
-    event_filename = os.path.join(args.event_folder, "event-{0}.json".format(event_id))
-
-    with open(event_filename, "at") as event_file:
-        debug_file.write(json.dumps(event) + "\n")
-
-    trigger_signal(pid)
+    # Hand it straight to the SecurityBot, or leave it in the spool for when it's back
+    try:
+        if not send_event(event, args.event_socket, args.timeout, args.event_spool):
+            print("SecurityBot isn't listening, spooled the event to {0}".format(args.event_spool), file=sys.stderr)
+    except OSError as e:
+        parser.exit(1, "Failed to send or spool the event: {0}\n".format(e))
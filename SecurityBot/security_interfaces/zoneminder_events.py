@@ -0,0 +1,192 @@
+from datetime import timedelta
+
+import sqlite3
+import threading
+import requests
+
+from SecurityBot import clock
+
+DEFAULT_EVENT_DATABASE = "/tmp/securitybot_events.sqlite"
+
+
+class ZoneMinderEventIndex(object):
+    """
+    A local SQLite index of ZoneMinder events
+    It is synced incrementally from the events API using the event ID as a cursor, so queries never touch ZoneMinder
+    Events still recording when we stored them are refreshed one by one by their ID, the cursor never goes back for them
+
+    The newest event ID we've stored is kept apart from the events themselves, so pruning every event doesn't send
+    the cursor back to the start of ZoneMinder's history
+    """
+    page_size = 100
+
+    # Events still recording have no end time, we refresh them until they finish (or are this old)
+    open_event_horizon = timedelta(days=1)
+
+    time_format = "%Y-%m-%d %H:%M:%S"
+
+    def __init__(self, path, logger):
+        self.path = path
+        self.logger = logger
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+
+        with self.lock, self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS events (
+                    id INTEGER PRIMARY KEY,
+                    monitor_id TEXT NOT NULL,
+                    start_time TEXT NOT NULL,
+                    end_time TEXT,
+                    length REAL,
+                    alarm_frames INTEGER,
+                    cause TEXT,
+                    notes TEXT
+                )
+            """)
+            self.connection.execute("CREATE INDEX IF NOT EXISTS events_monitor_start ON events (monitor_id, start_time)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def cursor(self):
+        """ The event ID we will continue syncing after """
+        with self.lock:
+            newest, = self.connection.execute("SELECT MAX(id) FROM events").fetchone()
+            newest_stored = self.connection.execute("SELECT value FROM meta WHERE key = 'newest_id'").fetchone()
+
+        # Indexes from before we kept newest_id only have their events to go on
+        return max(newest or 0, newest_stored[0] if newest_stored else 0)
+
+    def fetch_page(self, session, url, cursor, timeout):
+        endpoint = "{0}/api/events/index/Id >:{1}.json".format(url, cursor)
+        params = {
+            "sort": "Id",
+            "direction": "asc",
+            "limit": self.page_size,
+        }
+
+        response = session.get(endpoint, params=params, timeout=timeout)
+
+        if response.status_code != requests.codes.ok:
+            raise ValueError("Received a bad status code from ZoneMinder while fetching events")
+
+        return [event["Event"] for event in response.json().get("events", [])]
+
+    def fetch_event(self, session, url, event_id, timeout):
+        endpoint = "{0}/api/events/{1}.json".format(url, event_id)
+
+        response = session.get(endpoint, timeout=timeout)
+
+        if response.status_code != requests.codes.ok:
+            raise ValueError("Received a bad status code from ZoneMinder while fetching an event")
+
+        return response.json()["event"]["Event"]
+
+    def open_event_ids(self, limit):
+        """ The oldest `limit` events that were still recording when we stored them """
+        horizon = (clock.now() - self.open_event_horizon).strftime(self.time_format)
+
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id FROM events WHERE end_time IS NULL AND start_time > ? ORDER BY id LIMIT ?",
+                (horizon, limit)
+            ).fetchall()
+
+        return [event_id for event_id, in rows]
+
+    def store(self, events):
+        rows = []
+
+        for event in events:
+            rows.append((
+                int(event["Id"]),
+                str(event["MonitorId"]),
+                event.get("StartTime") or event.get("StartDateTime"),
+                event.get("EndTime") or event.get("EndDateTime"),
+                event.get("Length"),
+                event.get("AlarmFrames"),
+                event.get("Cause"),
+                event.get("Notes"),
+            ))
+
+        if not rows:
+            return
+
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.connection.execute("""
+                INSERT INTO meta VALUES ('newest_id', ?)
+                ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value)
+            """, (max(row[0] for row in rows),))
+
+    def sync(self, session, url, timeout, max_pages=None):
+        """
+        Pages through the events newer than our cursor and stores them
+        :param session: An authenticated ZoneMinder session
+        :param url: The ZoneMinder base URL
+        :param timeout: Seconds to wait for each page
+        :param max_pages: Stop after this many pages, the next sync carries on from where this one stopped
+        :return: True once there are no newer events left to sync, which is when open events are refreshed
+        """
+        cursor = self.cursor()
+        synced = 0
+        pages = 0
+        caught_up = False
+
+        while max_pages is None or pages < max_pages:
+            events = self.fetch_page(session, url, cursor, timeout)
+            pages += 1
+
+            if events:
+                self.store(events)
+                synced += len(events)
+                cursor = max(int(event["Id"]) for event in events)
+
+            if len(events) < self.page_size:
+                caught_up = True
+                break
+
+        self.logger.debug("Synced %s ZoneMinder events", synced)
+
+        if caught_up:
+            self.refresh_open_events(session, url, timeout)
+
+        return caught_up
+
+    def refresh_open_events(self, session, url, timeout):
+        """ Fetches up to a page worth of the events still recording again, storing any that have since finished """
+        events = [self.fetch_event(session, url, event_id, timeout) for event_id in self.open_event_ids(self.page_size)]
+        self.store(events)
+
+        self.logger.debug("Refreshed %s open ZoneMinder events", len(events))
+
+    def prune(self, retention):
+        """ Deletes events that started longer than retention ago """
+        before = (clock.now() - retention).strftime(self.time_format)
+
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM events WHERE start_time < ?", (before,))
+
+    def count(self):
+        with self.lock:
+            total, = self.connection.execute("SELECT COUNT(*) FROM events").fetchone()
+
+        return total
+
+    def query(self, monitor_id, window, limit):
+        """
+        Looks up the events at a monitor within the window
+        :return: The total number of events and (start_time, length, cause, notes) for the newest `limit` of them
+        """
+        since = (clock.now() - window).strftime(self.time_format)
+        where = "WHERE monitor_id = ? AND start_time >= ?"
+        args = (str(monitor_id), since)
+
+        with self.lock:
+            total, = self.connection.execute("SELECT COUNT(*) FROM events " + where, args).fetchone()
+            events = self.connection.execute(
+                "SELECT start_time, length, cause, notes FROM events " + where + " ORDER BY start_time DESC LIMIT ?",
+                args + (limit,)
+            ).fetchall()
+
+        return total, events
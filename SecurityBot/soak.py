@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+
+from collections import Counter, deque
+from datetime import timedelta
+
+import re
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+import tracemalloc
+
+from SecurityBot import clock
+from SecurityBot.queues import MessageQueue
+from SecurityBot.human_interfaces.slack import SlackInterface
+from SecurityBot.security_interfaces.zoneminder import ZoneMinderInterface, ZoneMinderEventIndex
+
+
+class StandInResponse(object):
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self.text = json.dumps(data)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class StandInZoneMinder(object):
+    """
+    Stands in for a requests.Session against ZoneMinder
+    Each monitor goes into alarm at random (on average every mean_alarm_interval simulated seconds) and raises an
+    event for the events API each time it does
+    """
+    status_regex = re.compile(r"/api/monitors/alarm/id:([0-9]+)/command:status\.json$")
+    events_regex = re.compile(r"/api/events/index/Id >:([0-9]+)\.json$")
+
+    def __init__(self, monitor_ids, mean_alarm_interval, rng):
+        self.mean_alarm_interval = mean_alarm_interval
+        self.rng = rng
+        self.lock = threading.Lock()
+        self.hooks = {"response": []}
+        self.requests = Counter()
+
+        now = clock.now()
+        self.alarm_until = dict((monitor_id, now) for monitor_id in monitor_ids)
+        self.next_alarm_at = dict((monitor_id, self.next_alarm(now)) for monitor_id in monitor_ids)
+
+        # Like ZoneMinder we only keep so many events around, few enough that the stand-in stops growing in warmup
+        self.events = deque(maxlen=200)
+        self.next_event_id = 1
+
+    def next_alarm(self, after):
+        return after + timedelta(seconds=self.rng.expovariate(1.0 / self.mean_alarm_interval))
+
+    def status(self, monitor_id):
+        now = clock.now()
+
+        with self.lock:
+            if now >= self.next_alarm_at[monitor_id]:
+                started = self.next_alarm_at[monitor_id]
+                self.alarm_until[monitor_id] = started + timedelta(seconds=self.rng.uniform(30, 300))
+                self.next_alarm_at[monitor_id] = self.next_alarm(self.alarm_until[monitor_id])
+
+                self.events.append({"Event": {
+                    "Id": self.next_event_id,
+                    "MonitorId": monitor_id,
+                    "StartTime": started.strftime(ZoneMinderEventIndex.time_format),
+                    "EndTime": self.alarm_until[monitor_id].strftime(ZoneMinderEventIndex.time_format),
+                    "Length": (self.alarm_until[monitor_id] - started).total_seconds(),
+                    "AlarmFrames": 10,
+                    "Cause": "Motion",
+                    "Notes": "",
+                }})
+                self.next_event_id += 1
+
+            return ZoneMinderInterface.ALARM_ACTIVE if now < self.alarm_until[monitor_id] else 0
+
+    def get(self, url, params=None, **_):
+        status_match = self.status_regex.search(url)
+
+        if status_match:
+            self.requests["status"] += 1
+            return StandInResponse(200, {"status": self.status(status_match.group(1))})
+
+        events_match = self.events_regex.search(url)
+
+        if events_match:
+            self.requests["events"] += 1
+            cursor = int(events_match.group(1))
+
+            with self.lock:
+                events = [event for event in self.events if event["Event"]["Id"] > cursor]
+
+            return StandInResponse(200, {"events": events[:params["limit"]]})
+
+        return StandInResponse(200, {})
+
+    def post(self, url, **_):
+        self.requests["post"] += 1
+        return StandInResponse(200, {})
+
+    def close(self):
+        pass
+
+
+class StandInSlackClient(object):
+    """
+    Stands in for SlackClient, sending a random command from a random user on average every mean_command_interval
+    simulated seconds, along with the non-message noise and the odd duplicate the real firehose has
+    """
+    noise = ({"type": "user_typing"}, {"type": "presence_change"}, {"type": "reconnect_url"})
+
+    def __init__(self, bot_id, channel_id, user_ids, locations, mean_command_interval, rng):
+        self.bot_id = bot_id
+        self.channel_id = channel_id
+        self.user_ids = user_ids
+        self.locations = locations
+        self.mean_command_interval = mean_command_interval
+        self.rng = rng
+
+        self.next_command_at = clock.monotonic()
+        self.last_event = None
+        self.calls = Counter()
+
+    def rtm_connect(self):
+        return True
+
+    def command(self):
+        location = self.rng.choice(self.locations)
+
+        return self.rng.choice([
+            "status {0}".format(location),
+            "arm {0}".format(location),
+            "disarm {0}".format(location),
+            "ack {0}".format(location),
+            "history {0} 1d".format(location),
+            "permissions",
+            "locations",
+            "help",
+        ])
+
+    def rtm_read(self):
+        events = [self.rng.choice(self.noise)]
+        now = clock.monotonic()
+
+        while self.next_command_at <= now:
+            self.last_event = {
+                "type": "message",
+                "channel": self.channel_id,
+                "user": self.rng.choice(self.user_ids),
+                "text": "<@{0}> {1}".format(self.bot_id, self.command()),
+                "ts": "{0:.6f}".format(self.next_command_at),
+            }
+            events.append(self.last_event)
+
+            self.next_command_at += self.rng.expovariate(1.0 / self.mean_command_interval)
+
+        if self.last_event and self.rng.random() < 0.01:
+            events.append(dict(self.last_event))
+
+        return events
+
+    def api_call(self, method, **kwargs):
+        self.calls[method] += 1
+        return {"ok": True, "ts": "{0:.6f}".format(sum(self.calls.values())), "channel": kwargs.get("channel")}
+
+
+def build_interfaces(monitors, users, rng, logger):
+    """ Builds a Slack and ZoneMinder interface wired together and to stand-ins, as main.py would """
+    locations = ["location-{0}".format(i) for i in range(monitors)]
+    user_ids = ["U{0:08d}".format(i) for i in range(users)]
+
+    config = {
+        "url": "http://stand-in/zm",
+        "alarm_alert_interval": "1m",
+        "alarm_expires_at": "5m",
+        "alarm_retention": "24h",
+        "alarm_digest_window": "2s",
+        "event_socket": None,
+        "history_database": ":memory:",
+        "history_sync_interval": "1m",
+        "history_window": "12h",
+        "history_retention": "2d",
+    }
+
+    human_interface_queue = MessageQueue()
+    security_interface_queue = MessageQueue()
+
+    zoneminder = ZoneMinderInterface(config,
+                                     ["zoneminder:user-{0}:*:{1}".format(i, ",".join(locations)) for i in range(users)],
+                                     ["zoneminder:{0}:{1}".format(location, i) for i, location in enumerate(locations)],
+                                     (human_interface_queue, security_interface_queue),
+                                     logger)
+    stand_in = StandInZoneMinder(list(zoneminder.monitors.keys()), 6 * 60 * 60, rng)
+    zoneminder.session = zoneminder.history_session = stand_in
+    zoneminder.command_sessions = [stand_in] * zoneminder.command_workers
+
+    slack = SlackInterface({"name": "slack"},
+                           ["slack:{0}:user-{1}".format(user_id, i) for i, user_id in enumerate(user_ids)],
+                           (security_interface_queue, human_interface_queue),
+                           zoneminder.get_commands(),
+                           logger)
+    slack.bot_id = "UBOT00000"
+    slack.channel_id = "CSOAK0000"
+    slack.slack_client = StandInSlackClient(slack.bot_id, slack.channel_id, user_ids, locations, 60, rng)
+    slack.ready = True
+
+    return slack, zoneminder
+
+
+def state_sizes(slack, zoneminder):
+    """ The size of every piece of long lived state, these should all stay flat """
+    return {
+        "alarms": len(zoneminder.alarms),
+        "indexed_events": zoneminder.event_index.count(),
+        "throttled_users": len(zoneminder.command_throttle.user_buckets),
+        "rendered_replies": len(zoneminder.rendered.rendered),
+        "seen_events": len(slack.seen_events),
+        "updatable_messages": len(slack.updatable_messages),
+        "command_queue": len(zoneminder.read_queue.heap),
+        "response_queue": len(slack.read_queue.heap),
+    }
+
+
+def soak(days, rate, monitors, users, snapshots, seed, logger):
+    """
+    Runs the interfaces against stand-ins for `days` of simulated time, `rate` times faster than real time
+    :return: The tracemalloc snapshots taken, evenly spaced through the run, with the simulated day they were taken on
+    """
+    clock.set_clock(clock.SimulatedClock(rate))
+    slack, zoneminder = build_interfaces(monitors, users, random.Random(seed), logger)
+
+    # Keep the loops running once a simulated second
+    zoneminder.poll_interval = 1.0 / rate
+    slack.web_socket_sleep_delay = 1.0 / rate
+
+    tracemalloc.start()
+
+    stop_event = threading.Event()
+    threads = [
+        threading.Thread(target=zoneminder.monitor, args=(stop_event,), name=zoneminder.name),
+        threading.Thread(target=slack.monitor, args=(stop_event,), name=slack.interface_id),
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    duration = days * 24 * 60 * 60
+    started = clock.monotonic()
+    taken = []
+
+    try:
+        for snapshot in range(1, snapshots + 1):
+            while clock.monotonic() - started < duration * snapshot / snapshots:
+                time.sleep(0.1)
+
+            day = (clock.monotonic() - started) / 86400
+            taken.append((day, tracemalloc.take_snapshot()))
+            current, peak = tracemalloc.get_traced_memory()
+
+            logger.info("Day %.2f: %.1fKiB traced (%.1fKiB peak), %s", day, current / 1024, peak / 1024,
+                        state_sizes(slack, zoneminder))
+    finally:
+        stop_event.set()
+
+        for thread in threads:
+            thread.join()
+
+        tracemalloc.stop()
+
+    logger.info("Slack calls: %s", dict(slack.slack_client.calls))
+    logger.info("ZoneMinder requests: %s", dict(zoneminder.session.requests))
+
+    return taken
+
+
+def report_growth(snapshots, warmup, top, logger):
+    """
+    Logs the allocation sites that grew the most between the first snapshot after `warmup` days and the last one
+    Until then state is expected to grow as it fills up to its retention bounds, the stand-ins themselves are ignored
+    """
+    ignore = (
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    )
+
+    first_day, first = next(((day, snapshot) for day, snapshot in snapshots if day >= warmup), snapshots[0])
+    last_day, last = snapshots[-1]
+    growth = last.filter_traces(ignore).compare_to(first.filter_traces(ignore), "lineno")
+
+    # Sites are where a block was first allocated, CPython reuses freed dicts, so a short lived site can be blamed for
+    # memory a long lived object holds now, cross check against state_sizes before chasing one
+
+    logger.info("Top %s allocation sites by growth between day %.2f and day %.2f:", top, first_day, last_day)
+
+    for stat in growth[:top]:
+        logger.info("%s", stat)
+
+    logger.info("Total growth: %.1fKiB", sum(stat.size_diff for stat in growth) / 1024)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Soak test the interfaces against local stand-ins on a simulated clock")
+    parser.add_argument("--days", type=float, default=3, help="Simulated days to run for")
+    parser.add_argument("--rate", type=float, default=1000, help="How many times faster than real time to run")
+    parser.add_argument("--monitors", type=int, default=50, help="Number of stand-in ZoneMinder monitors")
+    parser.add_argument("--users", type=int, default=5, help="Number of stand-in Slack users sending commands")
+    parser.add_argument("--snapshots", type=int, default=12, help="Number of tracemalloc snapshots to take")
+    parser.add_argument("--warmup", type=float, default=2,
+                        help="Simulated days to let state fill up to its retention bounds before measuring growth")
+    parser.add_argument("--top", type=int, default=15, help="Number of allocation sites to report")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the stand-ins")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    logger = logging.getLogger("SecurityBot")
+
+    # The interfaces are chatty at a thousand times real time, we only want the soak's own output
+    logging.getLogger("SecurityBot.zoneminder").setLevel(logging.ERROR)
+    logging.getLogger("SecurityBot.slack").setLevel(logging.ERROR)
+
+    snapshots = soak(args.days, args.rate, args.monitors, args.users, args.snapshots, args.seed, logger)
+    report_growth(snapshots, args.warmup, args.top, logger)
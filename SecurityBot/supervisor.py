@@ -0,0 +1,138 @@
+from collections import deque
+
+import threading
+
+from SecurityBot import clock
+
+
+class Worker(object):
+    """ An interface's monitor loop as run by the supervisor """
+    def __init__(self, name, interface, initial_backoff):
+        self.name = name
+        self.interface = interface
+
+        self.thread = None
+        self.stop_event = None
+        self.started_at = None
+
+        self.backoff = initial_backoff
+        self.failed_at = None
+        self.restart_at = None
+        self.restarts = 0
+
+
+class Supervisor(object):
+    """
+    Runs each interface's monitor loop on its own thread and restarts any that die or hang
+
+    A loop is considered hung when its LoopTimer hasn't beat for hang_timeout seconds. A hung thread can't be killed,
+    so it is told to stop and abandoned, the interface is readied up again (giving it a fresh session/connection) and
+    a new thread is started on the same interface object, which keeps any state such as alarms
+
+    Restarts back off exponentially up to max_backoff, the backoff resets once a worker has stayed up for max_backoff
+    """
+    check_interval = 1
+    hang_timeout = 15
+    initial_backoff = 1
+    max_backoff = 60
+
+    def __init__(self, logger, hang_timeout=None, initial_backoff=None, max_backoff=None):
+        self.logger = logger.getChild("supervisor")
+        self.workers = []
+
+        self.hang_timeout = hang_timeout or self.hang_timeout
+        self.initial_backoff = initial_backoff or self.initial_backoff
+        self.max_backoff = max_backoff or self.max_backoff
+
+        # Seconds from each failure being detected to the worker running again
+        self.recovery_times = deque(maxlen=100)
+
+    def add(self, name, interface):
+        self.workers.append(Worker(name, interface, self.initial_backoff))
+
+    def start_worker(self, worker):
+        worker.stop_event = threading.Event()
+        worker.started_at = clock.monotonic()
+        worker.interface.loop_timer.beat()
+
+        worker.thread = threading.Thread(target=self.run_worker, args=(worker, worker.stop_event),
+                                         name=worker.name, daemon=True)
+        worker.thread.start()
+
+    def run_worker(self, worker, stop_event):
+        try:
+            worker.interface.monitor(stop_event)
+        except Exception:
+            self.logger.exception("%s crashed", worker.name.title())
+
+    def start(self):
+        for worker in self.workers:
+            self.start_worker(worker)
+
+    def mean_time_to_recovery(self):
+        if not self.recovery_times:
+            return None
+
+        return sum(self.recovery_times) / len(self.recovery_times)
+
+    def fail(self, worker, reason):
+        worker.stop_event.set()
+        worker.failed_at = clock.monotonic()
+        worker.restart_at = worker.failed_at + worker.backoff
+
+        self.logger.error("%s %s, restarting it in %ss", worker.name.title(), reason, worker.backoff)
+        worker.backoff = min(worker.backoff * 2, self.max_backoff)
+
+    def restart(self, worker):
+        worker.restart_at = None
+        worker.restarts += 1
+
+        try:
+            ready = worker.interface.is_ready()
+        except Exception:
+            self.logger.exception("%s failed to ready up", worker.name.title())
+            ready = False
+
+        if not ready:
+            worker.restart_at = clock.monotonic() + worker.backoff
+            self.logger.error("%s failed to ready up, retrying in %ss", worker.name.title(), worker.backoff)
+            worker.backoff = min(worker.backoff * 2, self.max_backoff)
+            return
+
+        self.start_worker(worker)
+
+        recovery_time = clock.monotonic() - worker.failed_at
+        self.recovery_times.append(recovery_time)
+        self.logger.info("%s recovered in %.1fs (restart %s)", worker.name.title(), recovery_time, worker.restarts)
+
+    def check(self):
+        """ A single pass over every worker, restarting any that are dead or hung """
+        now = clock.monotonic()
+
+        for worker in self.workers:
+            if worker.restart_at is not None:
+                if now >= worker.restart_at:
+                    self.restart(worker)
+
+                continue
+
+            if not worker.thread.is_alive():
+                self.fail(worker, "died")
+            elif now - worker.interface.loop_timer.last_beat > self.hang_timeout:
+                self.fail(worker, "hung")
+            elif worker.backoff > self.initial_backoff and now - worker.started_at > self.max_backoff:
+                worker.backoff = self.initial_backoff
+
+    def run(self, stop_event=None):
+        """ Starts every worker and supervises them until the stop event is set (or forever) """
+        if stop_event is None:
+            stop_event = threading.Event()
+
+        self.start()
+
+        while not stop_event.wait(self.check_interval):
+            self.check()
+
+        for worker in self.workers:
+            if worker.stop_event:
+                worker.stop_event.set()
@@ -0,0 +1,93 @@
+import threading
+
+from SecurityBot import clock
+
+
+class TokenBucket(object):
+    """ Allows `rate` actions per second on average, with bursts of up to `burst` """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = clock.monotonic()
+
+    def refill(self):
+        now = clock.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class CommandThrottle(object):
+    """ Token bucket limits on commands, both per user and across every user """
+    def __init__(self, user_rate, user_burst, global_rate, global_burst):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+
+        self.user_buckets = {}
+        self.lock = threading.Lock()
+
+    def allow(self, common_id):
+        """ Takes a token from the user's bucket and the global one, returns False (taking nothing) if either is empty """
+        with self.lock:
+            if common_id not in self.user_buckets:
+                self.prune()
+                self.user_buckets[common_id] = TokenBucket(self.user_rate, self.user_burst)
+
+            user_bucket = self.user_buckets[common_id]
+            user_bucket.refill()
+            self.global_bucket.refill()
+
+            if user_bucket.tokens < 1 or self.global_bucket.tokens < 1:
+                return False
+
+            user_bucket.tokens -= 1
+            self.global_bucket.tokens -= 1
+
+            return True
+
+    def prune(self):
+        """ Forgets users whose buckets have refilled, they're no different to a brand new bucket """
+        for common_id, bucket in list(self.user_buckets.items()):
+            bucket.refill()
+
+            if bucket.tokens >= bucket.burst:
+                del self.user_buckets[common_id]
+
+
+class SingleFlight(object):
+    """
+    Collapses identical concurrent calls into one
+    While a call for a key is in flight, any other call for the same key waits for it and shares its result
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+
+    def do(self, key, function, *args):
+        with self.lock:
+            call = self.in_flight.get(key)
+
+            if call is None:
+                call = self.in_flight[key] = {"done": threading.Event(), "result": None, "error": None}
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            call["done"].wait()
+        else:
+            try:
+                call["result"] = function(*args)
+            except Exception as e:
+                call["error"] = e
+            finally:
+                with self.lock:
+                    del self.in_flight[key]
+
+                call["done"].set()
+
+        if call["error"] is not None:
+            raise call["error"]
+
+        return call["result"]
@@ -21,6 +21,7 @@ setup(
     install_requires=[
         "pyyaml>=3,<7",
         "slackclient>=1.1,<3",
+        "requests>=2,<3",
     ],
     python_requires="~=3.5",
     extras_require={
@@ -0,0 +1,35 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from SecurityBot import clock
+
+
+class FakeClock(clock.Clock):
+    """ A clock that only moves when it's told to """
+    def __init__(self):
+        self.elapsed = 0
+        self.started = datetime(2020, 1, 1)
+
+    def advance(self, seconds):
+        self.elapsed += seconds
+
+    def monotonic(self):
+        return self.elapsed
+
+    def utcnow(self):
+        return self.started + timedelta(seconds=self.elapsed)
+
+    def now(self):
+        return self.started + timedelta(seconds=self.elapsed)
+
+
+@pytest.fixture
+def fake_clock():
+    previous = clock.current
+    fake = FakeClock()
+    clock.set_clock(fake)
+
+    yield fake
+
+    clock.set_clock(previous)
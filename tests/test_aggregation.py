@@ -0,0 +1,88 @@
+from datetime import timedelta
+
+from SecurityBot.queues import MessageQueue, PRIORITY_ALARM, PRIORITY_NOTICE
+from SecurityBot.aggregation import AlarmAggregator
+
+
+def posted(queue):
+    messages = []
+
+    while not queue.empty():
+        messages.append(queue.get_nowait())
+
+    return messages
+
+
+def flush(aggregator, *changes):
+    for location, state in changes:
+        aggregator.add(location, state)
+
+    aggregator.flush(force=True)
+    return posted(aggregator.write_queue)
+
+
+def test_nothing_is_posted_until_the_window_passes(fake_clock):
+    aggregator = AlarmAggregator(timedelta(seconds=2), MessageQueue())
+
+    aggregator.add("front door", AlarmAggregator.RAISED)
+    aggregator.flush()
+    assert posted(aggregator.write_queue) == []
+
+    fake_clock.advance(3)
+    aggregator.flush()
+    assert [m["text"] for m in posted(aggregator.write_queue)] == ["Uhh ohh, Front Door is under attack!"]
+
+
+def test_a_lone_change_is_posted_as_a_single_message(fake_clock):
+    aggregator = AlarmAggregator(timedelta(seconds=2), MessageQueue())
+
+    raised, = flush(aggregator, ("garage", AlarmAggregator.RAISED))
+    ongoing, = flush(aggregator, ("garage", AlarmAggregator.ONGOING))
+    finished, = flush(aggregator, ("garage", AlarmAggregator.FINISHED))
+
+    assert raised["priority"] == PRIORITY_ALARM
+    assert finished["priority"] == PRIORITY_ALARM
+    assert finished["text"] == "Garage is no longer under attack!"
+
+    # Only the repeat notices can be shed or coalesced
+    assert ongoing["priority"] == PRIORITY_NOTICE
+    assert ongoing["coalesce_key"] is not None
+
+
+def test_a_storm_is_posted_as_one_digest_updated_until_it_settles(fake_clock):
+    aggregator = AlarmAggregator(timedelta(seconds=2), MessageQueue())
+
+    digest, = flush(aggregator, ("a", AlarmAggregator.RAISED), ("b", AlarmAggregator.RAISED))
+    update, = flush(aggregator, ("a", AlarmAggregator.FINISHED))
+    settled, = flush(aggregator, ("b", AlarmAggregator.FINISHED))
+
+    assert digest["text"] == ":rotating_light: 2 locations under attack: A, B"
+    assert update["options"]["update_key"] == digest["options"]["update_key"]
+    assert update["text"] == ":rotating_light: 1 location under attack: B\n1 location no longer under attack: A"
+    assert settled["options"]["update_key"] == digest["options"]["update_key"]
+
+    # Everything settled, so the next change starts afresh
+    single, = flush(aggregator, ("c", AlarmAggregator.RAISED))
+    assert "update_key" not in single["options"]
+
+
+def test_a_new_alarm_starts_a_new_digest_carrying_over_unsettled_locations(fake_clock):
+    aggregator = AlarmAggregator(timedelta(seconds=2), MessageQueue())
+
+    digest, = flush(aggregator, ("a", AlarmAggregator.RAISED), ("b", AlarmAggregator.RAISED))
+    flush(aggregator, ("a", AlarmAggregator.FINISHED))
+    new_digest, = flush(aggregator, ("c", AlarmAggregator.RAISED))
+
+    assert new_digest["options"]["update_key"] != digest["options"]["update_key"]
+    assert new_digest["text"] == ":rotating_light: 2 locations under attack: B, C"
+
+
+def test_an_old_digest_is_not_updated(fake_clock):
+    aggregator = AlarmAggregator(timedelta(seconds=2), MessageQueue(), max_age=timedelta(minutes=10))
+
+    digest, = flush(aggregator, ("a", AlarmAggregator.RAISED), ("b", AlarmAggregator.RAISED))
+    fake_clock.advance(11 * 60)
+    update, = flush(aggregator, ("a", AlarmAggregator.FINISHED))
+
+    assert update["options"]["update_key"] != digest["options"]["update_key"]
+    assert update["text"] == ":rotating_light: 1 location under attack: B\n1 location no longer under attack: A"
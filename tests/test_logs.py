@@ -0,0 +1,40 @@
+import json
+import logging
+
+from SecurityBot.logs import RateLimitFilter, StructuredFormatter
+
+
+def record(message, **extra):
+    log_record = logging.LogRecord("SecurityBot.test", logging.WARNING, __file__, 1, message, (), None)
+    log_record.__dict__.update(extra)
+    return log_record
+
+
+def test_records_are_limited_per_key_noting_how_many_were_suppressed(fake_clock):
+    rate_limit = RateLimitFilter(interval=10)
+
+    assert rate_limit.filter(record("Failed", rate_limit="a"))
+    assert not rate_limit.filter(record("Failed", rate_limit="a"))
+    assert not rate_limit.filter(record("Failed", rate_limit="a"))
+
+    # Other keys, and records without one, aren't held back
+    assert rate_limit.filter(record("Failed", rate_limit="b"))
+    assert rate_limit.filter(record("Failed"))
+    assert rate_limit.filter(record("Failed"))
+
+    fake_clock.advance(10)
+    let_through = record("Failed", rate_limit="a")
+
+    assert rate_limit.filter(let_through)
+    assert let_through.getMessage() == "Failed (2 similar suppressed)"
+    assert let_through.suppressed == 2
+
+
+def test_structured_records_are_one_json_object_including_extras():
+    structured = json.loads(StructuredFormatter().format(record("Command: %s", command="arm")))
+
+    assert structured["logger"] == "SecurityBot.test"
+    assert structured["level"] == "WARNING"
+    assert structured["message"] == "Command: %s"
+    assert structured["command"] == "arm"
+    assert "exception" not in structured
@@ -0,0 +1,118 @@
+from queue import Empty
+
+import pytest
+
+from SecurityBot.queues import MessageQueue, PRIORITY_ALARM, PRIORITY_REPLY, PRIORITY_NOTICE
+
+
+def message(text, priority=PRIORITY_REPLY, coalesce_key=None):
+    return {"text": text, "priority": priority, "coalesce_key": coalesce_key}
+
+
+def drain(queue):
+    texts = []
+
+    while not queue.empty():
+        texts.append(queue.get_nowait()["text"])
+
+    return texts
+
+
+def test_higher_priorities_come_out_first_and_in_order_within_a_priority():
+    queue = MessageQueue()
+
+    queue.put(message("notice", PRIORITY_NOTICE))
+    queue.put(message("reply 1"))
+    queue.put(message("alarm", PRIORITY_ALARM))
+    queue.put(message("reply 2"))
+
+    assert drain(queue) == ["alarm", "reply 1", "reply 2", "notice"]
+
+
+def test_get_on_an_empty_queue_raises_empty():
+    queue = MessageQueue()
+
+    with pytest.raises(Empty):
+        queue.get_nowait()
+
+    with pytest.raises(Empty):
+        queue.get(timeout=0.01)
+
+
+def test_coalesced_messages_replace_the_queued_one_in_place():
+    queue = MessageQueue()
+
+    queue.put(message("first", coalesce_key="a"))
+    queue.put(message("other"))
+    queue.put(message("second", coalesce_key="a"))
+
+    assert queue.qsize() == 2
+    assert queue.stats()["coalesced"] == 1
+    assert drain(queue) == ["second", "other"]
+
+
+def test_coalescing_stops_once_the_message_has_been_read():
+    queue = MessageQueue()
+
+    queue.put(message("first", coalesce_key="a"))
+    assert queue.get_nowait()["text"] == "first"
+
+    queue.put(message("second", coalesce_key="a"))
+    assert drain(queue) == ["second"]
+
+
+def test_a_full_queue_drops_new_messages_of_the_same_priority():
+    queue = MessageQueue(maxsize=2)
+
+    for text in ("1", "2", "3"):
+        queue.put(message(text))
+
+    assert drain(queue) == ["1", "2"]
+    assert queue.stats()["dropped"] == {"overflow": 1}
+
+
+def test_a_full_queue_sheds_the_newest_lowest_priority_message():
+    queue = MessageQueue(maxsize=3)
+
+    queue.put(message("notice 1", PRIORITY_NOTICE))
+    queue.put(message("notice 2", PRIORITY_NOTICE))
+    queue.put(message("reply 1"))
+    queue.put(message("reply 2"))
+
+    assert drain(queue) == ["reply 1", "reply 2", "notice 1"]
+    assert queue.stats()["dropped"] == {"shed": 1}
+
+
+def test_stale_replies_are_shed_first(fake_clock):
+    queue = MessageQueue(maxsize=2, reply_ttl=60)
+
+    queue.put(message("old reply"))
+    fake_clock.advance(61)
+    queue.put(message("notice", PRIORITY_NOTICE))
+    queue.put(message("new reply"))
+
+    assert drain(queue) == ["new reply", "notice"]
+    assert queue.stats()["dropped"] == {"stale": 1}
+
+
+def test_alarms_are_never_dropped():
+    queue = MessageQueue(maxsize=2)
+
+    for i in range(5):
+        queue.put(message("alarm {0}".format(i), PRIORITY_ALARM))
+
+    assert drain(queue) == ["alarm {0}".format(i) for i in range(5)]
+    assert queue.stats()["dropped"] == {}
+
+
+def test_shed_entries_are_compacted_out_of_the_heap():
+    queue = MessageQueue(maxsize=2)
+
+    queue.put(message("alarm", PRIORITY_ALARM))
+
+    for i in range(20):
+        queue.put(message("notice {0}".format(i), PRIORITY_NOTICE))
+        queue.put(message("reply {0}".format(i)))
+
+    assert len(queue.heap) <= 2 * queue.maxsize + 1
+    assert drain(queue)[0] == "alarm"
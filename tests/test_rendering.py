@@ -0,0 +1,45 @@
+from SecurityBot.rendering import RenderCache, render_table
+
+
+def test_a_short_table_is_a_single_message():
+    pages = render_table("Locations", "{0:<10}{1}", ("Location", "ID"), [("garage", 1), ("porch", 2)])
+
+    assert pages == ["Locations:\n```Location  ID\ngarage    1\nporch     2\n```"]
+
+
+def test_a_footer_ends_the_table():
+    pages = render_table("Events", "{0}", ("Started",), [("today",)], footer="... and 3 more")
+
+    assert pages == ["Events:\n```Started\ntoday\n... and 3 more\n```"]
+
+
+def test_a_long_table_is_paged_under_the_limit_with_headings_on_every_page():
+    rows = [("row {0:03d}".format(i),) for i in range(200)]
+    pages = render_table("Rows", "{0}", ("Heading",), rows, max_length=500)
+
+    assert len(pages) > 1
+    assert all(len(page) <= 500 for page in pages)
+
+    for number, page in enumerate(pages, start=1):
+        assert page.startswith("Rows (page {0}/{1}):\n```Heading\n".format(number, len(pages)))
+        assert page.endswith("\n```")
+
+    # Every row appears exactly once, in order
+    lines = [line for page in pages for line in page.split("\n")[2:-1]]
+    assert lines == [row for row, in rows]
+
+
+def test_the_render_cache_renders_again_only_for_a_new_version():
+    cache = RenderCache()
+    renders = []
+
+    def render(value):
+        renders.append(value)
+        return "rendered {0}".format(value)
+
+    assert cache.get("key", 1, render, "a") == "rendered a"
+    assert cache.get("key", 1, render, "b") == "rendered a"
+    assert cache.get("key", 2, render, "c") == "rendered c"
+
+    assert renders == ["a", "c"]
+    assert (cache.hits, cache.misses) == (1, 2)
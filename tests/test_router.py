@@ -0,0 +1,57 @@
+import logging
+import threading
+
+from SecurityBot.queues import MessageQueue
+from SecurityBot.router import MessageRouter
+
+
+def build_router():
+    router = MessageRouter(MessageQueue(), logging.getLogger("test"))
+    subscribers = {"slack": MessageQueue(maxsize=2), "console": MessageQueue(maxsize=2)}
+
+    for interface_id, queue in subscribers.items():
+        router.subscribe(interface_id, queue)
+
+    return router, subscribers
+
+
+def test_replies_go_to_their_interface_and_everything_else_to_all():
+    router, subscribers = build_router()
+
+    router.route({"text": "reply", "options": {"interface": "slack"}})
+    router.route({"text": "alarm", "options": {}})
+
+    assert [subscribers["slack"].get_nowait()["text"] for _ in range(2)] == ["reply", "alarm"]
+    assert subscribers["console"].get_nowait()["text"] == "alarm"
+    assert subscribers["console"].empty()
+
+
+def test_the_router_is_full_while_any_subscriber_is():
+    router, subscribers = build_router()
+    assert not router.full()
+
+    router.route({"text": "one", "options": {"interface": "slack"}})
+    router.route({"text": "two", "options": {"interface": "slack"}})
+    assert router.full()
+
+    subscribers["slack"].get_nowait()
+    assert not router.full()
+
+
+def test_monitor_routes_until_stopped_and_beats_while_idle():
+    router, subscribers = build_router()
+    stop_event = threading.Event()
+
+    thread = threading.Thread(target=router.monitor, args=(stop_event,))
+    thread.start()
+
+    router.inbound_queue.put({"text": "alarm", "options": {}})
+    assert subscribers["slack"].get(timeout=1)["text"] == "alarm"
+
+    beat = router.loop_timer.last_beat
+    thread.join(1.5)
+    assert router.loop_timer.last_beat > beat
+
+    stop_event.set()
+    thread.join()
+    assert not thread.is_alive()
@@ -0,0 +1,44 @@
+import logging
+
+from SecurityBot.queues import MessageQueue
+from SecurityBot.human_interfaces.slack import SlackInterface, SeenEvents
+
+
+def test_seen_events_drops_repeats_within_the_window(fake_clock):
+    seen = SeenEvents(window=10, max_size=100)
+
+    assert not seen.check(("C1", "1.0"))
+    assert seen.check(("C1", "1.0"))
+    assert not seen.check(("C2", "1.0"))
+
+
+def test_seen_events_forgets_keys_older_than_the_window(fake_clock):
+    seen = SeenEvents(window=10, max_size=100)
+
+    seen.check("old")
+    fake_clock.advance(11)
+    seen.check("new")
+
+    assert len(seen) == 1
+    assert not seen.check("old")
+
+
+def test_seen_events_is_bounded(fake_clock):
+    seen = SeenEvents(window=10, max_size=3)
+
+    for key in range(10):
+        seen.check(key)
+
+    assert len(seen) == 3
+    assert seen.check(9)
+    assert not seen.check(0)
+
+
+def test_each_slack_interface_times_its_loop_under_its_own_id():
+    timers = [
+        SlackInterface({"name": "slack", "id": interface_id}, [], (MessageQueue(), MessageQueue()), {},
+                       logging.getLogger("test")).loop_timer
+        for interface_id in ("slack-home", "slack-work")
+    ]
+
+    assert [timer.name for timer in timers] == ["slack-home", "slack-work"]
@@ -0,0 +1,112 @@
+import logging
+import threading
+
+from SecurityBot.profiling import LoopTimer
+from SecurityBot.supervisor import Supervisor
+
+
+class StandInInterface(object):
+    """ An interface whose monitor loop crashes or hangs the first time it's run, then runs normally """
+    def __init__(self, fault):
+        self.fault = fault
+        self.loop_timer = LoopTimer("stand-in", 1, logging.getLogger("test"))
+        self.ready_ups = 0
+        self.runs = 0
+        self.released = threading.Event()
+
+    def is_ready(self):
+        self.ready_ups += 1
+        return True
+
+    def monitor(self, stop_event):
+        self.runs += 1
+
+        if self.runs == 1 and self.fault == "crash":
+            raise RuntimeError("Crashed")
+
+        if self.runs == 1 and self.fault == "hang":
+            # Never beats, and ignores being told to stop
+            self.released.wait()
+            return
+
+        stop_event.wait()
+
+
+def supervise(fault):
+    supervisor = Supervisor(logging.getLogger("test"), hang_timeout=15, initial_backoff=1, max_backoff=60)
+    interface = StandInInterface(fault)
+    supervisor.add(fault, interface)
+    supervisor.start()
+
+    return supervisor, supervisor.workers[0], interface
+
+
+def test_a_crashed_worker_is_restarted_after_its_backoff(fake_clock):
+    supervisor, worker, interface = supervise("crash")
+    worker.thread.join()
+
+    fake_clock.advance(0.5)
+    supervisor.check()
+    assert worker.restart_at == 1.5
+
+    # Not until the backoff is up
+    supervisor.check()
+    assert worker.restarts == 0
+
+    fake_clock.advance(1)
+    supervisor.check()
+
+    assert worker.restarts == 1 and interface.ready_ups == 1
+    assert worker.thread.is_alive()
+    assert supervisor.mean_time_to_recovery() == 1
+    assert worker.backoff == 2
+
+    worker.stop_event.set()
+    worker.thread.join()
+
+
+def test_a_hung_worker_is_abandoned_and_restarted(fake_clock):
+    supervisor, worker, interface = supervise("hang")
+    hung_thread = worker.thread
+
+    fake_clock.advance(10)
+    supervisor.check()
+    assert worker.restart_at is None
+
+    fake_clock.advance(6)
+    supervisor.check()
+    assert worker.restart_at == 17
+    assert worker.stop_event.is_set()
+
+    fake_clock.advance(1)
+    supervisor.check()
+
+    assert worker.restarts == 1 and interface.ready_ups == 1
+    assert worker.thread is not hung_thread and worker.thread.is_alive()
+    assert supervisor.mean_time_to_recovery() == 1
+
+    interface.released.set()
+    worker.stop_event.set()
+    worker.thread.join()
+    hung_thread.join()
+
+
+def test_the_backoff_resets_once_a_worker_stays_up(fake_clock):
+    supervisor, worker, interface = supervise("crash")
+    worker.thread.join()
+
+    supervisor.check()
+    fake_clock.advance(1)
+    supervisor.check()
+    assert worker.backoff == 2
+
+    # Beating all the while, so it isn't hung
+    for _ in range(61):
+        fake_clock.advance(1)
+        interface.loop_timer.beat()
+
+    supervisor.check()
+    assert worker.backoff == 1
+
+    worker.stop_event.set()
+    worker.thread.join()
@@ -0,0 +1,105 @@
+import time
+import threading
+
+import pytest
+
+from SecurityBot.throttle import TokenBucket, CommandThrottle, SingleFlight
+
+
+def test_token_bucket_refills_at_its_rate_up_to_its_burst(fake_clock):
+    bucket = TokenBucket(rate=2, burst=5)
+    bucket.tokens = 0
+
+    fake_clock.advance(1)
+    bucket.refill()
+    assert bucket.tokens == 2
+
+    fake_clock.advance(10)
+    bucket.refill()
+    assert bucket.tokens == 5
+
+
+def test_each_user_gets_their_own_burst(fake_clock):
+    throttle = CommandThrottle(user_rate=1, user_burst=2, global_rate=100, global_burst=100)
+
+    assert [throttle.allow("alice") for _ in range(3)] == [True, True, False]
+    assert throttle.allow("bob")
+
+    fake_clock.advance(1)
+    assert throttle.allow("alice")
+
+
+def test_the_global_bucket_limits_everyone_combined(fake_clock):
+    throttle = CommandThrottle(user_rate=1, user_burst=5, global_rate=1, global_burst=3)
+
+    assert [throttle.allow(user) for user in ("a", "b", "c", "d")] == [True, True, True, False]
+
+
+def test_a_throttled_command_takes_no_tokens(fake_clock):
+    throttle = CommandThrottle(user_rate=1, user_burst=1, global_rate=1, global_burst=1)
+
+    assert throttle.allow("alice")
+    assert not throttle.allow("bob")
+
+    # Bob's rejected command didn't spend his token
+    fake_clock.advance(1)
+    assert throttle.allow("bob")
+
+
+def test_full_buckets_are_pruned_when_a_new_user_arrives(fake_clock):
+    throttle = CommandThrottle(user_rate=1, user_burst=2, global_rate=100, global_burst=100)
+
+    throttle.allow("alice")
+    fake_clock.advance(10)
+    throttle.allow("bob")
+
+    assert list(throttle.user_buckets.keys()) == ["bob"]
+
+
+def test_single_flight_collapses_concurrent_calls():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def slow_call(value):
+        calls.append(value)
+        release.wait(5)
+        return value * 2
+
+    def caller():
+        results.append(single_flight.do("key", slow_call, 21))
+
+    leader = threading.Thread(target=caller)
+    leader.start()
+
+    while not single_flight.in_flight:
+        pass
+
+    followers = [threading.Thread(target=caller) for _ in range(3)]
+
+    for thread in followers:
+        thread.start()
+
+    # Give the followers a moment to join the call in flight
+    time.sleep(0.1)
+    release.set()
+
+    for thread in [leader] + followers:
+        thread.join()
+
+    assert calls == [21]
+    assert results == [42] * 4
+    assert single_flight.in_flight == {}
+
+
+def test_single_flight_shares_errors_and_forgets_finished_calls():
+    single_flight = SingleFlight()
+
+    def failing_call():
+        raise ValueError("nope")
+
+    with pytest.raises(ValueError):
+        single_flight.do("key", failing_call)
+
+    assert single_flight.do("key", lambda: "fresh") == "fresh"
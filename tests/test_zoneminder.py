@@ -0,0 +1,141 @@
+from datetime import timedelta
+
+import os
+import time
+import socket
+import logging
+import pytest
+import threading
+
+from SecurityBot.queues import MessageQueue
+from SecurityBot.soak import StandInResponse
+from SecurityBot.security_interfaces.zoneminder import ZoneMinderInterface, parse_timedelta, format_timedelta, \
+    send_event, spool_event
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("0s", timedelta(0)),
+    ("30s", timedelta(seconds=30)),
+    ("5m", timedelta(minutes=5)),
+    ("12h", timedelta(hours=12)),
+    ("30d", timedelta(days=30)),
+])
+def test_parse_timedelta(value, expected):
+    assert parse_timedelta(value) == expected
+
+
+@pytest.mark.parametrize("value", ["", "5", "m", "5w", "-5m", "1.5h", "5m "])
+def test_parse_timedelta_rejects_invalid_values(value):
+    assert parse_timedelta(value) is None
+
+
+@pytest.mark.parametrize("delta, expected", [
+    (timedelta(0), "0s"),
+    (timedelta(seconds=90), "90s"),
+    (timedelta(minutes=5), "5m"),
+    (timedelta(hours=36), "36h"),
+    (timedelta(days=2), "2d"),
+])
+def test_format_timedelta(delta, expected):
+    assert format_timedelta(delta) == expected
+    assert parse_timedelta(expected) == delta
+
+
+def build_zoneminder(permissions, **config):
+    return ZoneMinderInterface(dict({"url": "http://zoneminder/zm", "event_socket": None, "history_database": ":memory:"},
+                                    **config),
+                               permissions,
+                               ["zoneminder:garage:1"],
+                               (MessageQueue(), MessageQueue()),
+                               logging.getLogger("test"))
+
+
+class FunctionSession(object):
+    """ Stands in for a command session, noting each function a monitor is set to, arming slower than disarming """
+    def __init__(self):
+        self.functions = []
+
+    def post(self, url, data=None, **_):
+        if data["Monitor[Function]"] == "Modect":
+            time.sleep(0.2)
+
+        self.functions.append(data["Monitor[Function]"])
+        return StandInResponse(200, {})
+
+
+def test_permissions_are_listed_whatever_the_case_of_the_user():
+    zoneminder = build_zoneminder(["zoneminder:Alice:arm:garage", "zoneminder:bob:*:*"])
+
+    reply, = zoneminder.list_permissions(["alice"])
+    assert "Alice" in reply and "bob" not in reply
+
+    assert zoneminder.list_permissions(["ALICE"]) == [reply]
+    assert zoneminder.list_permissions(["carol"]) == "Unknown user sorry!"
+
+
+def test_commands_for_a_monitor_run_in_the_order_they_came_in():
+    zoneminder = build_zoneminder(["zoneminder:alice:*:garage"])
+    session = FunctionSession()
+    zoneminder.command_sessions = [session] * zoneminder.command_workers
+    zoneminder.poll_interval = 0.01
+
+    stop_event = threading.Event()
+    thread = threading.Thread(target=zoneminder.command_lane, args=(stop_event,))
+    thread.start()
+
+    try:
+        for command in ("arm", "disarm"):
+            zoneminder.read_queue.put({"command": command, "options": ["garage"], "common_id": "alice",
+                                       "response_options": {}})
+
+        replies = [zoneminder.write_queue.get(timeout=2)["text"] for _ in range(2)]
+    finally:
+        stop_event.set()
+        thread.join()
+
+    assert session.functions == ["Modect", "Monitor"]
+    assert replies == ["Armed!", "Disarmed!"]
+
+
+def test_the_hook_spools_events_when_nobody_is_listening(tmp_path):
+    event_socket = str(tmp_path / "events.sock")
+    event_spool = str(tmp_path / "spool")
+
+    assert not send_event({"event_id": "1"}, event_socket, timeout=0.1, spool=event_spool)
+
+    # A stale socket, left behind by a listener that's gone
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    stale.bind(event_socket)
+    stale.close()
+
+    assert not send_event({"event_id": "2"}, event_socket, timeout=0.1, spool=event_spool)
+    assert len(os.listdir(event_spool)) == 2
+
+
+def test_the_listener_reads_the_spool_and_the_socket(tmp_path):
+    event_socket = str(tmp_path / "events.sock")
+    zoneminder = build_zoneminder([], event_spool=str(tmp_path / "spool"))
+    zoneminder.poll_interval = 0.01
+
+    spool_event({"event_id": "1"}, zoneminder.event_spool)
+
+    stop_event = threading.Event()
+    thread = threading.Thread(target=zoneminder.listen_for_events, args=(event_socket, stop_event))
+    thread.start()
+
+    try:
+        while not os.path.exists(event_socket):
+            time.sleep(0.01)
+
+        assert send_event({"event_id": "2"}, event_socket, timeout=1, spool=zoneminder.event_spool)
+
+        received = []
+
+        while len(received) < 2:
+            received.extend(zoneminder.write_queue.get(timeout=2)["text"].split("\n"))
+    finally:
+        stop_event.set()
+        thread.join()
+
+    assert sorted(received) == ["{'event_id': '1'}", "{'event_id': '2'}"]
+    assert os.listdir(zoneminder.event_spool) == []
@@ -0,0 +1,109 @@
+from datetime import timedelta
+
+import logging
+import re
+
+from SecurityBot import clock
+from SecurityBot.soak import StandInResponse
+from SecurityBot.security_interfaces.zoneminder_events import ZoneMinderEventIndex
+
+
+def event(event_id, started, ended=True):
+    return {
+        "Id": str(event_id),
+        "MonitorId": "1",
+        "StartTime": started.strftime(ZoneMinderEventIndex.time_format),
+        "EndTime": (started + timedelta(seconds=30)).strftime(ZoneMinderEventIndex.time_format) if ended else None,
+        "Length": 30,
+        "AlarmFrames": 10,
+        "Cause": "Motion",
+        "Notes": "",
+    }
+
+
+def test_the_cursor_follows_the_newest_event(fake_clock):
+    index = ZoneMinderEventIndex(":memory:", logging.getLogger("test"))
+    assert index.cursor() == 0
+
+    index.store([event(1, clock.now()), event(2, clock.now())])
+    assert index.cursor() == 2
+
+
+def test_the_cursor_doesnt_wait_on_events_still_recording(fake_clock):
+    index = ZoneMinderEventIndex(":memory:", logging.getLogger("test"))
+
+    index.store([event(1, clock.now()), event(2, clock.now(), ended=False), event(3, clock.now())])
+
+    assert index.cursor() == 3
+    assert index.open_event_ids(10) == [2]
+
+
+def test_pruning_every_event_keeps_the_cursor(fake_clock):
+    index = ZoneMinderEventIndex(":memory:", logging.getLogger("test"))
+
+    index.store([event(1, clock.now()), event(2, clock.now())])
+    fake_clock.advance(3 * 24 * 60 * 60)
+    index.prune(timedelta(days=2))
+
+    assert index.count() == 0
+    assert index.cursor() == 2
+
+
+def test_restoring_an_older_event_doesnt_move_the_cursor_back(fake_clock):
+    index = ZoneMinderEventIndex(":memory:", logging.getLogger("test"))
+
+    index.store([event(5, clock.now())])
+    index.store([event(3, clock.now())])
+
+    assert index.cursor() == 5
+
+
+class EventsSession(object):
+    """ Stands in for ZoneMinder's events API over the given events, counting the requests made """
+    index_regex = re.compile(r"/api/events/index/Id >:([0-9]+)\.json$")
+    event_regex = re.compile(r"/api/events/([0-9]+)\.json$")
+
+    def __init__(self, events):
+        self.events = dict((int(event["Id"]), event) for event in events)
+        self.requests = 0
+
+    def get(self, url, params=None, **_):
+        self.requests += 1
+        index_match = self.index_regex.search(url)
+
+        if index_match:
+            newer = [self.events[event_id] for event_id in sorted(self.events) if event_id > int(index_match.group(1))]
+            return StandInResponse(200, {"events": [{"Event": event} for event in newer[:params["limit"]]]})
+
+        return StandInResponse(200, {"event": {"Event": self.events[int(self.event_regex.search(url).group(1))]}})
+
+
+def test_an_open_event_doesnt_hold_the_sync_back(fake_clock):
+    index = ZoneMinderEventIndex(":memory:", logging.getLogger("test"))
+    session = EventsSession([event(1, clock.now(), ended=False)] + [event(i, clock.now()) for i in range(2, 2002)])
+
+    passes = 0
+
+    while not index.sync(session, "http://zoneminder/zm", 5, max_pages=10):
+        passes += 1
+        assert passes < 5
+
+    assert index.cursor() == 2001
+    assert index.count() == 2001
+
+
+def test_open_events_are_refreshed_by_id_once_caught_up(fake_clock):
+    index = ZoneMinderEventIndex(":memory:", logging.getLogger("test"))
+    session = EventsSession([event(1, clock.now(), ended=False), event(2, clock.now())])
+
+    assert index.sync(session, "http://zoneminder/zm", 5)
+    assert index.open_event_ids(10) == [1]
+
+    session.events[1] = event(1, clock.now())
+    session.requests = 0
+
+    assert index.sync(session, "http://zoneminder/zm", 5)
+    assert index.open_event_ids(10) == []
+
+    # One page past the cursor, and the open event by its ID
+    assert session.requests == 2